@@ -2,7 +2,7 @@ import numpy as np
 import pandas as pd
 import lightgbm as lgb
 from sklearn.model_selection import (
-    train_test_split, GridSearchCV, StratifiedKFold
+    train_test_split, GridSearchCV, ParameterGrid, StratifiedKFold
 )
 from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import precision_score, recall_score, make_scorer
@@ -10,6 +10,8 @@ from sklearn.utils.class_weight import compute_class_weight
 from imblearn.under_sampling import RandomUnderSampler
 from sklearn.preprocessing import LabelEncoder
 
+from thread_budget import split_budget
+
 # ======================= 1. 配置关键参数（根据你的需求修改） =======================
 RECALL_TARGET = 0.5 # 正样本召回率最低目标值（你可根据实际需求调整）
 POS_LABEL = 1       # 正样本标签 (0=负样本, 1=正样本)
@@ -91,7 +93,6 @@ base_model = lgb.LGBMClassifier(
     # is_unbalance=True,
     scale_pos_weight=N_P,
     random_state=RANDOM_SEED,
-    n_jobs=-1,
     reg_alpha=0.1,
     reg_lambda=0.1
 )
@@ -109,6 +110,11 @@ param_grid = {
 # 内层分层交叉验证
 cv_inner = StratifiedKFold(n_splits=10, shuffle=True, random_state=RANDOM_SEED)
 
+# 网格搜索的并行任务数 × 每个LightGBM的线程数 不超过线程预算（两层都用-1会严重超额订阅CPU）；
+# 候选参数组合 × 折数 少于核数时，多出的线程分给LightGBM
+GRID_N_JOBS, LGBM_N_JOBS = split_budget(-1, n_tasks=len(ParameterGrid(param_grid)) * cv_inner.get_n_splits())
+base_model.set_params(n_jobs=LGBM_N_JOBS)
+
 # 网格搜索：用自定义评分器，优先保证召回≥目标值，再选精度最高的参数
 grid_search = GridSearchCV(
     estimator=base_model,
@@ -116,7 +122,7 @@ grid_search = GridSearchCV(
     cv=cv_inner,
     scoring=custom_scroer,
     refit=True,
-    n_jobs=-1,
+    n_jobs=GRID_N_JOBS,
     verbose=1
 )
 
@@ -4,20 +4,361 @@ import lightgbm as lgb
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import roc_auc_score
 import matplotlib.pyplot as plt
+import copy
+import hashlib
 import json
 import os
+import pickle
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from data_loader import load_typed_csv, source_fingerprint
+from pu_predictions import save_predictions
+from shared_matrix import SharedMatrix
+from thread_budget import available_threads, budgeted_process_pool, resolve_threads, split_budget
 
 # 解决中文显示问题
 plt.rcParams['font.sans-serif'] = ['SimHei']
 plt.rcParams['axes.unicode_minus'] = False
 
+# 模型文件格式版本，保存结构变化时递增，加载时据此拒绝不兼容的旧文件
+MODEL_FORMAT_VERSION = 1
+# 默认的模型仓库目录，每次训练保存为一个带版本号的模型文件
+MODEL_STORE_DIR = 'result/pu_model_store'
+# 默认的子模型训练记录文件（JSON lines，每行一个子模型）
+TELEMETRY_PATH = 'result/pu_telemetry/pu_bags.jsonl'
+# 增量打分的缓存目录，按模型版本保存每行特征指纹对应的违约概率
+SCORE_CACHE_DIR = 'result/pu_score_cache'
+
+# 子进程内缓存的训练数据，由 _init_bag_worker 在进程启动时设置一次，避免每个任务重复序列化
+_worker_state = {}
+
+def _init_bag_worker(estimator, X_train, y_train, n_p, n_threads, warm_start_rounds=None):
+    """进程池初始化函数：每个子进程只对P∪U全集分箱一次，之后各子模型共享该分箱结果"""
+    t0 = time.time()
+    train_set = estimator._build_train_set(X_train, y_train, n_threads, free_raw_data=warm_start_rounds is None)
+    _worker_state.update(
+        estimator=estimator, n_p=n_p, n_threads=n_threads, warm_start_rounds=warm_start_rounds,
+        train_set=train_set, bin_time=time.time() - t0,
+        X_u_values=_u_values(X_train, n_p) if estimator.oob_score else None
+    )
+
+def _train_bag_in_worker(i):
+    """在子进程中训练（或增量训练）第i个子模型"""
+    s = _worker_state
+    model, oob_pred, stats = s['estimator']._train_bag(
+        s['train_set'], s['n_p'], i, s['n_threads'], s['X_u_values'], s['warm_start_rounds']
+    )
+    stats['bin_time'] = s['bin_time']
+    return model, oob_pred, stats
+
+def _peak_rss_mb():
+    """当前进程的峰值常驻内存（MB）；resource仅类Unix可用，其余平台尝试psutil，都不可用时返回None"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux下单位为KB，macOS下为字节
+        return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / 1024 ** 2
+    except ImportError:
+        return None
+
+def _feature_matrix(X):
+    """
+    DataFrame -> 数值矩阵；category列取类别编码（缺失为NaN），与LightGBM训练时对pandas分类特征的转换一致
+    （要求预测数据与训练数据的类别列表相同，由PreprocessPlan的固定编码表保证）
+    """
+    categorical = [col for col, dtype in X.dtypes.items() if isinstance(dtype, pd.CategoricalDtype)]
+    if not categorical:
+        return X.to_numpy()
+    codes = {col: X[col].cat.codes.astype(np.float64).where(X[col].notna()) for col in categorical}
+    return X.assign(**codes).to_numpy(dtype=np.float64)
+
+def _u_values(X_train, n_p):
+    """P∪U全集中U部分的特征矩阵；共享矩阵直接取内存映射的切片，不复制"""
+    if isinstance(X_train, SharedMatrix):
+        return X_train.features[n_p:]
+    return _feature_matrix(X_train.iloc[n_p:])
+
+def _categorical_positions(X):
+    """category列的位置，用于以矩阵形式构造LightGBM数据集时声明分类特征"""
+    return [i for i, dtype in enumerate(X.dtypes) if isinstance(dtype, pd.CategoricalDtype)]
+
+def sample_bag_indices(n_u, n_u_sample, n_bags, random_seed=42, replace=None):
+    """
+    一次性生成所有子模型的U集采样行号
+    n_u: U集样本数
+    n_u_sample: 每个子模型采样的U样本数
+    n_bags: 子模型个数
+    replace: 是否有放回采样，None表示仅在采样数超过U集大小时有放回
+    return: 形状为 (n_bags, n_u_sample) 的行号矩阵（U集内的位置，每行升序）
+    """
+    if replace is None:
+        replace = n_u_sample > n_u
+    rng = np.random.default_rng(random_seed)
+
+    # 按子模型顺序逐行抽取，前k行只取决于随机种子，与n_bags无关
+    if replace:
+        bag_indices = rng.integers(0, n_u, size=(n_bags, n_u_sample))
+    else:
+        bag_indices = np.empty((n_bags, n_u_sample), dtype=np.int64)
+        for i in range(n_bags):
+            bag_indices[i] = rng.choice(n_u, n_u_sample, replace=False, shuffle=False)
+    bag_indices.sort(axis=1)
+    return bag_indices
+
 class BaggingPULeaning:
-    def __init__(self, n_estimators=200, imbalance_ratio=0.2, random_seed=42):
+    def __init__(self, n_estimators=200, imbalance_ratio=0.2, random_seed=42, n_workers=1, bootstrap=None,
+                 oob_score=False, num_boost_round=1200, early_stopping_rounds=None, valid_ratio=0.2,
+                 checkpoint_dir=None, adaptive_tol=None, adaptive_metric='mean_abs_change', monitor_size=2000,
+                 check_every=10, min_estimators=20, top_k=100, categorical_feature='auto', shared_matrix_dir=None,
+                 n_threads=-1, telemetry_path=None):
+        """
+        n_workers: 并行训练子模型的进程数，1为串行，-1为使用全部CPU核
+        bootstrap: U集是否有放回采样，None表示仅在采样数超过U集大小时有放回
+        oob_score: 是否在训练时累积U集的袋外（OOB）概率，每个U样本只由未见过它的子模型打分
+        num_boost_round: 每个子模型的最大迭代轮数
+        early_stopping_rounds: 早停轮数，None表示不早停、固定训练num_boost_round轮
+        valid_ratio: 早停时每个子模型留出的验证比例（P集留出该比例，U集从袋外样本中按该比例抽取）
+        checkpoint_dir: 断点目录，每训练完一个子模型即写入磁盘；配置与数据指纹一致时从已完成的子模型继续训练
+        adaptive_tol: 自适应集成规模的收敛阈值，None表示固定训练n_estimators个子模型
+        adaptive_metric: 收敛指标，'mean_abs_change'为监控样本平均概率的平均绝对变化，
+                         'topk_overlap'为前top_k高风险样本重合度（以 1-重合度 与阈值比较）
+        monitor_size: 监控样本数（从P∪U全集中按random_seed固定抽取）
+        check_every: 每新增多少个子模型检查一次收敛
+        min_estimators: 最少训练的子模型个数
+        top_k: topk_overlap 指标使用的前k个样本数
+        categorical_feature: 传给LightGBM的分类特征，'auto'表示pandas category列按原生分类特征处理
+                             （配合PreprocessPlan(native_categorical=True)使用），也可传列名列表
+        shared_matrix_dir: 共享特征矩阵目录，提供时P∪U全集只以float32内存映射文件写入一次，
+                           各进程（含串行模式）从该矩阵构造训练集，不再向每个子进程序列化DataFrame
+        n_threads: 串行训练时LightGBM的线程数，-1为当前进程的全部线程预算（见thread_budget）；并行训练时按进程均分
+        telemetry_path: 每个子模型训练记录（样本数、分箱/训练耗时、树的数量、峰值内存、验证指标）追加写入的JSON lines文件
+        """
         self.n_estimators = n_estimators
         self.imbalance_ratio = imbalance_ratio
         self.random_seed = random_seed
+        self.n_workers = n_workers
+        self.bootstrap = bootstrap
+        self.oob_score = oob_score
+        self.num_boost_round = num_boost_round
+        self.early_stopping_rounds = early_stopping_rounds
+        self.valid_ratio = valid_ratio
+        self.checkpoint_dir = checkpoint_dir
+        self.adaptive_tol = adaptive_tol
+        self.adaptive_metric = adaptive_metric
+        self.monitor_size = monitor_size
+        self.check_every = check_every
+        self.min_estimators = min_estimators
+        self.top_k = top_k
+        self.categorical_feature = categorical_feature
+        self.shared_matrix_dir = shared_matrix_dir
+        self.n_threads = n_threads
+        self.telemetry_path = telemetry_path
+        # 本次训练/刷新的运行标识，写入每条训练记录，便于按运行查询
+        self.telemetry_run_ = None
         self.models = []
         self.feature_names = []
+        # 训练数据使用的预处理配置及拟合好的预处理方案，随模型一起保存，打分时按同一方案处理新数据
+        self.preprocess_config = None
+        self.preprocess_plan = None
+        # 模型版本号，保存到模型仓库时生成
+        self.ensemble_version_ = None
+        # 每个子模型采样的U集行号矩阵 (n_estimators, n_u_sample)，以及对应的U集原始索引
+        self.bag_indices_ = None
+        self.u_index_ = None
+        # 每个子模型训练过的全部U集样本的原始索引（增量刷新后包含历次采样），这些样本对该子模型不再是袋外样本
+        self.seen_u_index_ = None
+        # U集每个样本的袋外概率累加值与打分次数
+        self.oob_sum_ = None
+        self.oob_count_ = None
+        # 训练配置与数据的指纹，指纹一致的模型可以在已有子模型基础上继续训练
+        self.fingerprint_ = None
+        # 增量刷新次数
+        self.n_refreshes_ = 0
+        # 自适应模式下实际使用的子模型个数及每次收敛检查的记录
+        self.n_estimators_ = None
+        self.convergence_history_ = []
+        # 自适应停止的结果（收敛时的子模型个数、停止设置与检查记录），随断点清单保存，恢复或重跑时不再越过收敛点训练
+        self.convergence_ = None
+        self._monitor = None
+        # 剪枝模型的来源版本、保留的子模型编号及与完整集成的排序一致性
+        self.pruned_from_ = None
+        self.pruned_indices_ = None
+        self.fidelity_ = None
+
+    def get_params(self):
+        """模型的构造参数"""
+        return {
+            'n_estimators': self.n_estimators,
+            'imbalance_ratio': self.imbalance_ratio,
+            'random_seed': self.random_seed,
+            'n_workers': self.n_workers,
+            'bootstrap': self.bootstrap,
+            'oob_score': self.oob_score,
+            'num_boost_round': self.num_boost_round,
+            'early_stopping_rounds': self.early_stopping_rounds,
+            'valid_ratio': self.valid_ratio,
+            'checkpoint_dir': self.checkpoint_dir,
+            'adaptive_tol': self.adaptive_tol,
+            'adaptive_metric': self.adaptive_metric,
+            'monitor_size': self.monitor_size,
+            'check_every': self.check_every,
+            'min_estimators': self.min_estimators,
+            'top_k': self.top_k,
+            'categorical_feature': self.categorical_feature,
+            'shared_matrix_dir': self.shared_matrix_dir,
+            'n_threads': self.n_threads,
+            'telemetry_path': self.telemetry_path
+        }
+
+    def _training_fingerprint(self, X_p, X_u, y_p, y_u):
+        """
+        训练配置+数据指纹；子模型个数、进程数、断点目录及自适应停止设置不影响已训练子模型的结果，不计入指纹；
+        共享矩阵只有是否启用（特征转为float32）影响结果，与目录位置无关
+        """
+        params = self.get_params()
+        for key in ('n_estimators', 'n_workers', 'n_threads', 'checkpoint_dir', 'adaptive_tol', 'adaptive_metric',
+                    'monitor_size', 'check_every', 'min_estimators', 'top_k', 'telemetry_path'):
+            params.pop(key)
+        params['shared_matrix_dir'] = params['shared_matrix_dir'] is not None
+        h = hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8'))
+        h.update(data_fingerprint(X_p, X_u, y_p, y_u).encode('utf-8'))
+        return h.hexdigest()
+
+    def _bag_params(self, i, n_threads=-1):
+        """第i个子模型的LightGBM参数，种子随迭代变化（random_seed + i）"""
+        return {
+            'objective': 'binary',
+            'metric': 'average_precision',
+            'verbosity': -1,
+            'learning_rate': 0.05,
+            'num_leaves': 20,
+            'n_jobs': n_threads,
+            'scale_pos_weight': 2,
+            'max_depth': 4,
+            'min_child_samples': 50,
+            'subsample': 0.7,
+            'colsample_bytree': 0.7,
+            'boosting_type': 'gbdt',
+            'seed': self.random_seed + i
+        }
+
+    def _build_train_set(self, X_train, y_train, n_threads=-1, free_raw_data=True):
+        """
+        对P∪U全集一次性完成特征分箱，各子模型通过行索引取子集，共享同一套分箱映射
+        free_raw_data: 增量训练需要用原始特征计算已有树的初始得分，此时需保留原始数据
+        X_train: DataFrame或SharedMatrix（矩阵中category列为编码，按保存的类别信息声明为分类特征）
+        """
+        if isinstance(X_train, SharedMatrix):
+            categorical = self.categorical_feature
+            if categorical == 'auto':
+                categorical = X_train.categorical_columns or 'auto'
+            return lgb.Dataset(
+                X_train.features, label=y_train, feature_name=X_train.columns,
+                params={'verbosity': -1, 'n_jobs': n_threads},
+                categorical_feature=categorical, free_raw_data=free_raw_data
+            ).construct()
+        return lgb.Dataset(
+            X_train, label=y_train, params={'verbosity': -1, 'n_jobs': n_threads},
+            categorical_feature=self.categorical_feature, free_raw_data=free_raw_data
+        ).construct()
+
+    def _train_bag(self, train_set, n_p, i, n_threads=-1, X_u_values=None, warm_start_rounds=None):
+        """
+        训练第i个子模型，串行与并行模式共用，保证结果一致
+        X_u_values: U集特征矩阵，提供时同时返回该子模型对其袋外样本的预测概率
+        warm_start_rounds: 增量训练轮数，提供时在已有的第i个子模型上继续训练
+        return: (子模型, 袋外预测概率或None, 训练记录)
+        """
+        t0 = time.time()
+        stats = {'bag': i, 'pid': os.getpid()}
+        params = self._bag_params(i, n_threads)
+        init_model = None
+        num_boost_round = self.num_boost_round
+        if warm_start_rounds is not None:
+            init_model = self.models[i]
+            num_boost_round = warm_start_rounds
+
+        if not self.early_stopping_rounds:
+            # 训练集 = 全部P样本（全集前n_p行）+ 本轮采样的U样本，正负样本比例1:1，期望能从U集中找到更多P集合
+            used_indices = np.concatenate([np.arange(n_p), n_p + self.bag_indices_[i]])
+            model = lgb.train(
+                params, train_set.subset(used_indices), num_boost_round=num_boost_round, init_model=init_model
+            )
+            stats.update(n_train_p=n_p, n_train_u=len(used_indices) - n_p, n_valid=0, valid_metric=None)
+        else:
+            train_indices, valid_indices = self._early_stopping_split(n_p, i)
+            model = lgb.train(
+                params, train_set.subset(train_indices), num_boost_round=num_boost_round, init_model=init_model,
+                valid_sets=[train_set.subset(valid_indices)],
+                callbacks=[lgb.early_stopping(self.early_stopping_rounds, verbose=False)]
+            )
+            n_train_p = int(np.searchsorted(train_indices, n_p))
+            stats.update(
+                n_train_p=n_train_p, n_train_u=len(train_indices) - n_train_p, n_valid=len(valid_indices),
+                valid_metric=model.best_score['valid_0'].get('average_precision'), best_iteration=model.best_iteration
+            )
+            # 只保留最优迭代及之前的树，预测与保存都不再携带无效的树
+            model = lgb.Booster(model_str=model.model_to_string(num_iteration=model.best_iteration))
+        stats.update(train_time=time.time() - t0, n_trees=model.num_trees())
+
+        oob_pred = None
+        if X_u_values is not None:
+            t0 = time.time()
+            oob_pred = model.predict(X_u_values[self._oob_mask(i)], num_threads=resolve_threads(n_threads))
+            stats['oob_time'] = time.time() - t0
+        stats['peak_rss_mb'] = _peak_rss_mb()
+        return model, oob_pred, stats
+
+    def _early_stopping_split(self, n_p, i):
+        """
+        早停模式下第i个子模型的训练/验证行号（P∪U全集内的位置）
+        验证集 = 留出的部分P样本 + 本轮袋外U样本的随机子集，以average_precision评估
+        """
+        rng = np.random.default_rng([self.random_seed, i])
+        bag = self.bag_indices_[i]
+
+        p_perm = rng.permutation(n_p)
+        n_valid_p = min(n_p - 1, max(1, int(n_p * self.valid_ratio)))
+        valid_p, train_p = np.sort(p_perm[:n_valid_p]), np.sort(p_perm[n_valid_p:])
+
+        oob_positions = np.flatnonzero(self._oob_mask(i))
+        n_valid_u = min(len(oob_positions), max(1, int(len(bag) * self.valid_ratio)))
+        valid_u = np.sort(rng.choice(oob_positions, n_valid_u, replace=False))
+
+        train_indices = np.concatenate([train_p, n_p + bag])
+        valid_indices = np.concatenate([valid_p, n_p + valid_u])
+        return train_indices, valid_indices
+
+    def _seen_u_labels(self, i):
+        """第i个子模型训练过的全部U样本的原始索引（旧版本保存的模型没有历史记录时为本次采样的样本）"""
+        if self.seen_u_index_ is None:
+            return self.u_index_[self.bag_indices_[i]]
+        return self.seen_u_index_[i]
+
+    def _oob_mask(self, i):
+        """第i个子模型的袋外U样本掩码（排除该子模型在历次训练与刷新中见过的全部U样本）"""
+        mask = np.ones(len(self.u_index_), dtype=bool)
+        mask[self.bag_indices_[i]] = False
+        if self.seen_u_index_ is not None:
+            mask &= ~self.u_index_.isin(self.seen_u_index_[i])
+        return mask
+
+    def _resolve_workers(self, n_bags):
+        """解析并行进程数与每个进程分得的线程数"""
+        # 线程预算在进程间均分，避免 进程数 × n_jobs=-1 导致CPU超额订阅；
+        # 本身运行在外层进程池中时，预算为外层分给本进程的线程数
+        n_workers, n_threads = split_budget(self.n_workers, n_bags)
+        if n_workers == 1:
+            n_threads = resolve_threads(self.n_threads)
+        return n_workers, n_threads
 
     def fit(self, X_p, X_u, y_p, y_u):
         self.feature_names = X_p.columns.tolist()
@@ -26,184 +367,1074 @@ class BaggingPULeaning:
         print("开始训练 Bagging PU 模型（共{}个子模型）".format(self.n_estimators))
         print("Positive 样本数: {}, 每次迭代Unlabeled采样数: {}".format(n_p, n_u_sample))
 
-        for i in range(self.n_estimators):
-            # 数据采样优化：随机种子随迭代变化，有放回采样（样本量小时）
-            replace = True if n_u_sample > len(X_u) else False
-            y_u_subset = y_u.sample(n_u_sample, random_state=self.random_seed + i, replace=replace)
-            X_u_subset = X_u.loc[y_u_subset.index]
-
-            # 拼接训练集，正负样本比例1:1，期望能从U集中找到更多P集合
-            X_train = pd.concat([X_p, X_u_subset])
-            y_train = pd.concat([y_p, y_u_subset])
-
-            params = {
-                'objective': 'binary',
-                'metric': 'average_precision',
-                'verbosity': -1,
-                'learning_rate': 0.05,
-                'num_leaves': 20,
-                'n_jobs': -1,
-                'scale_pos_weight': 2,
-                'max_depth': 4,
-                'min_child_samples': 50,
-                'subsample': 0.7,
-                'colsample_bytree': 0.7,
-                'boosting_type': 'gbdt',
-                'seed': self.random_seed + i
-            }
+        # 数据采样优化：一次性生成全部子模型的U集行号
+        self.u_index_ = X_u.index
+        self.bag_indices_ = sample_bag_indices(
+            len(X_u), n_u_sample, self.n_estimators, self.random_seed, self.bootstrap
+        )
+        self.seen_u_index_ = [self.u_index_[np.unique(bag)] for bag in self.bag_indices_]
+
+        # 同一配置和数据下已训练的子模型（内存中或断点目录中）直接复用，只训练剩余的子模型
+        fingerprint = self._training_fingerprint(X_p, X_u, y_p, y_u)
+        self._restore_bags(fingerprint, len(X_u))
+        start = len(self.models)
+        stop_at = self._converged_stop()
+        if stop_at is not None and start >= stop_at:
+            # 同一配置与数据在相同的自适应停止设置下已经收敛（断点目录或上次训练），与不中断训练的结果一致
+            print(f"已在第 {stop_at} 个子模型处收敛，无需继续训练")
+            self.convergence_history_ = list(self.convergence_['history'])
+            self.n_estimators_ = len(self.models)
+            self.bag_indices_ = self.bag_indices_[:self.n_estimators_]
+            self.seen_u_index_ = self.seen_u_index_[:self.n_estimators_]
+            return self
+        self.convergence_ = None
+        self.convergence_history_ = []
+        if start >= self.n_estimators:
+            print(f"已有 {start} 个子模型，无需继续训练")
+            self.n_estimators_ = len(self.models)
+            return self
+        if start > 0:
+            print(f"复用已完成的 {start} 个子模型，继续训练第 {start + 1}~{self.n_estimators} 个")
+        self._run_bags(range(start, self.n_estimators), X_p, X_u, y_p, y_u)
+
+        self.n_estimators_ = len(self.models)
+        if self.adaptive_tol is not None:
+            # 提前停止时只保留实际使用的子模型对应的采样行号
+            self.bag_indices_ = self.bag_indices_[:self.n_estimators_]
+            self.seen_u_index_ = self.seen_u_index_[:self.n_estimators_]
+            print(f"自适应集成规模: 使用 {self.n_estimators_}/{self.n_estimators} 个子模型")
+        return self
+
+    def _run_bags(self, bag_ids, X_p, X_u, y_p, y_u, warm_start_rounds=None):
+        """串行或在进程池中训练指定编号的子模型，结果按编号顺序收集"""
+        n_p = len(X_p)
+        n_workers, n_threads = self._resolve_workers(len(bag_ids))
+
+        self.telemetry_run_ = {
+            'run_id': '{}_{}'.format(time.strftime('%Y%m%d_%H%M%S'), os.getpid()),
+            'mode': 'refresh' if warm_start_rounds else 'fit', 'n_workers': n_workers, 'n_threads': n_threads
+        }
+
+        # P∪U全集只拼接一次，P在前、U在后
+        X_train = pd.concat([X_p[self.feature_names], X_u[self.feature_names]])
+        y_train = np.concatenate([y_p.to_numpy(), y_u.to_numpy()])
+
+        # 自适应模式：在固定的监控样本上跟踪集成平均概率的变化
+        self._monitor = None
+        window = len(bag_ids)
+        if self.adaptive_tol is not None and warm_start_rounds is None:
+            self._init_monitor(X_train)
+            window = max(self.check_every, n_workers)
+
+        if self.shared_matrix_dir is not None:
+            # 全集只写入一次，子进程按路径挂载
+            X_train = SharedMatrix.create(X_train, self.shared_matrix_dir, y_train)
+
+        if n_workers == 1:
+            t0 = time.time()
+            train_set = self._build_train_set(X_train, y_train, n_threads, free_raw_data=warm_start_rounds is None)
+            bin_time = time.time() - t0
+            X_u_values = _u_values(X_train, n_p) if self.oob_score else None
+            del X_train
+            results = (
+                (model, oob_pred, dict(stats, bin_time=bin_time))
+                for model, oob_pred, stats in (
+                    self._train_bag(train_set, n_p, i, n_threads, X_u_values, warm_start_rounds) for i in bag_ids
+                )
+            )
+            # 串行时结果惰性生成，收敛后不再训练后续子模型
+            self._collect_models(bag_ids, results, checkpoint=warm_start_rounds is None)
+            self._monitor = None
+            return
+
+        print("并行训练: {}个进程, 每个进程{}个线程".format(n_workers, n_threads))
+        # 子进程只需要训练配置与采样行号；增量训练时才需要已有的子模型
+        worker_estimator = copy.copy(self)
+        if warm_start_rounds is None:
+            worker_estimator.models = []
+        worker_estimator.oob_sum_ = worker_estimator.oob_count_ = None
+        worker_estimator._monitor = None
+        with budgeted_process_pool(
+            n_workers, n_threads,
+            initializer=_init_bag_worker,
+            initargs=(worker_estimator, X_train, y_train, n_p, n_threads, warm_start_rounds)
+        ) as executor:
+            # executor.map 按提交顺序返回结果，子模型顺序与串行训练一致；
+            # 自适应模式下按窗口分批提交，收敛后不再提交新的子模型
+            for start in range(0, len(bag_ids), window):
+                window_ids = bag_ids[start:start + window]
+                converged = self._collect_models(
+                    window_ids, executor.map(_train_bag_in_worker, window_ids), checkpoint=warm_start_rounds is None
+                )
+                if converged:
+                    break
+        self._monitor = None
+
+    def _adaptive_settings(self):
+        """决定收敛点的自适应停止设置，设置不同时已记录的收敛点不再适用"""
+        return {
+            key: getattr(self, key)
+            for key in ('adaptive_tol', 'adaptive_metric', 'monitor_size', 'check_every', 'min_estimators', 'top_k')
+        }
+
+    def _converged_stop(self):
+        """已记录的收敛点（自适应设置一致且不超过n_estimators时），否则为None"""
+        c = self.convergence_
+        if (self.adaptive_tol is None or c is None or c['settings'] != self._adaptive_settings()
+                or c['n_estimators'] > self.n_estimators):
+            return None
+        return c['n_estimators']
 
-            # 训练LightGBM
-            dtrain = lgb.Dataset(X_train, label=y_train)
-            model = lgb.train(params, dtrain, num_boost_round=1200)  # 迭代轮数提升至1200
-            self.models.append(model)
+    def _record_convergence(self, n_models):
+        """记录收敛点，并写入断点清单"""
+        self.convergence_ = {
+            'n_estimators': n_models, 'settings': self._adaptive_settings(),
+            'history': list(self.convergence_history_)
+        }
+        if not self.checkpoint_dir:
+            return
+        manifest_path = os.path.join(self.checkpoint_dir, 'manifest.json')
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        manifest['convergence'] = self.convergence_
+        tmp_path = manifest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, manifest_path)
+
+    def _init_monitor(self, X_train):
+        """
+        抽取固定的监控样本，并计入已有子模型（断点恢复或内存复用）的预测；
+        上一次检查的集成平均取自已有子模型中最后一个检查点，之后的检查与不中断训练时完全一致
+        """
+        rng = np.random.default_rng(self.random_seed)
+        n_monitor = min(self.monitor_size, len(X_train))
+        positions = np.sort(rng.choice(len(X_train), n_monitor, replace=False))
+        X_monitor = _feature_matrix(X_train.iloc[positions])
+        pred_sum = np.zeros(n_monitor)
+        prev_mean = None
+        last_check = len(self.models) - len(self.models) % self.check_every
+        for k, model in enumerate(self.models, 1):
+            pred_sum += model.predict(X_monitor)
+            if k == last_check:
+                prev_mean = pred_sum / k
+        self._monitor = {'X': X_monitor, 'sum': pred_sum, 'prev_mean': prev_mean}
+
+    def _update_monitor(self, model):
+        """
+        累加新子模型在监控样本上的预测，每check_every个子模型比较一次集成平均概率的变化
+        return: 是否已收敛
+        """
+        m = self._monitor
+        m['sum'] += model.predict(m['X'])
+        n_models = len(self.models)
+        if n_models % self.check_every != 0:
+            return False
+
+        cur_mean = m['sum'] / n_models
+        prev_mean, m['prev_mean'] = m['prev_mean'], cur_mean
+        if prev_mean is None:
+            return False
+
+        k = min(self.top_k, len(cur_mean))
+        prev_top = np.argpartition(-prev_mean, k - 1)[:k]
+        cur_top = np.argpartition(-cur_mean, k - 1)[:k]
+        record = {
+            'n_estimators': n_models,
+            'mean_abs_change': float(np.mean(np.abs(cur_mean - prev_mean))),
+            'topk_overlap': len(np.intersect1d(prev_top, cur_top)) / k
+        }
+        self.convergence_history_.append(record)
+
+        change = record['mean_abs_change'] if self.adaptive_metric == 'mean_abs_change' else 1 - record['topk_overlap']
+        converged = n_models >= self.min_estimators and change < self.adaptive_tol
+        if converged:
+            self._record_convergence(n_models)
+            print(f"集成得分已收敛（{self.adaptive_metric} 变化 {change:.6f} < {self.adaptive_tol}），"
+                  f"在第 {n_models} 个子模型处停止")
+        return converged
+
+    def refresh(self, X_p, X_u, y_p, y_u, n_rounds=100):
+        """
+        增量刷新：新增确认违约客户后，在每个已有子模型的基础上继续训练，而不是从头重训全部子模型
+        X_p, y_p: 更新后的P集（包含新确认的违约客户）
+        X_u, y_u: 更新后的U集，每个子模型重新采样
+        n_rounds: 每个子模型最多追加的迭代轮数（开启早停时按验证集提前停止）
+        """
+        if not self.models:
+            raise ValueError("模型未训练，请先调用fit()方法")
+        n_p = len(X_p)
+        n_u_sample = int(n_p * self.imbalance_ratio)
+        self.n_refreshes_ += 1
+        print("开始增量刷新 Bagging PU 模型（共{}个子模型，每个最多追加{}轮）".format(len(self.models), n_rounds))
+        print("Positive 样本数: {}, 每次迭代Unlabeled采样数: {}".format(n_p, n_u_sample))
+
+        # 以刷新次数区分随机种子，U集重新采样；已有的树仍基于之前采样的U样本，
+        # 这些样本累积在seen_u_index_中，刷新后同样不计入该子模型的袋外样本
+        previous_seen = [self._seen_u_labels(i) for i in range(len(self.models))]
+        self.u_index_ = X_u.index
+        self.bag_indices_ = sample_bag_indices(
+            len(X_u), n_u_sample, len(self.models), [self.random_seed, self.n_refreshes_], self.bootstrap
+        )
+        self.seen_u_index_ = [
+            seen.union(self.u_index_[np.unique(bag)]) for seen, bag in zip(previous_seen, self.bag_indices_)
+        ]
+        # 刷新后的子模型不等价于在新数据上重新训练，指纹中记录刷新来源，避免被fit()误复用
+        self.fingerprint_ = hashlib.sha1(
+            (str(self.fingerprint_) + data_fingerprint(X_p, X_u, y_p, y_u)).encode('utf-8')
+        ).hexdigest()
+        self.ensemble_version_ = None
+        if self.oob_score:
+            self.oob_sum_ = np.zeros(len(X_u))
+            self.oob_count_ = np.zeros(len(X_u), dtype=np.int32)
+
+        self._run_bags(range(len(self.models)), X_p, X_u, y_p, y_u, warm_start_rounds=n_rounds)
+        return self
+
+    def _restore_bags(self, fingerprint, n_u):
+        """按指纹恢复已完成的子模型：优先复用内存中的模型，其次读取断点目录，指纹不一致则从头训练"""
+        reuse_in_memory = (
+            self.fingerprint_ == fingerprint and 0 < len(self.models) <= self.n_estimators
+            and (not self.oob_score or self.oob_sum_ is not None)
+        )
+        self.fingerprint_ = fingerprint
+        if reuse_in_memory:
+            return
+
+        self.models = []
+        self.convergence_ = None
+        if self.oob_score:
+            self.oob_sum_ = np.zeros(n_u)
+            self.oob_count_ = np.zeros(n_u, dtype=np.int32)
+        else:
+            self.oob_sum_ = self.oob_count_ = None
+        if not self.checkpoint_dir:
+            return
+
+        manifest_path = os.path.join(self.checkpoint_dir, 'manifest.json')
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get('fingerprint') != fingerprint:
+                print("断点目录中的配置或数据指纹不一致，忽略已有断点，从头训练")
+            else:
+                self.convergence_ = manifest.get('convergence')
+                # 只接续编号连续的已完成子模型
+                for i in range(self.n_estimators):
+                    model_path = self._checkpoint_path(i, 'txt')
+                    oob_path = self._checkpoint_path(i, 'npy')
+                    if not os.path.exists(model_path) or (self.oob_score and not os.path.exists(oob_path)):
+                        break
+                    self.models.append(lgb.Booster(model_file=model_path))
+                    if self.oob_score:
+                        self._add_oob(i, np.load(oob_path))
+                if self.models:
+                    print(f"从断点目录恢复 {len(self.models)} 个子模型: {self.checkpoint_dir}")
+                return
+
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump({'fingerprint': fingerprint, 'params': self.get_params()}, f, ensure_ascii=False, indent=4)
+        for name in os.listdir(self.checkpoint_dir):
+            if name.startswith('bag_'):
+                os.remove(os.path.join(self.checkpoint_dir, name))
+
+    def _checkpoint_path(self, i, ext):
+        return os.path.join(self.checkpoint_dir, f'bag_{i:05d}.{ext}')
+
+    def _save_checkpoint(self, i, model, oob_pred):
+        """把第i个子模型写入断点目录，先写临时文件再改名，避免中断时留下不完整的文件"""
+        if oob_pred is not None:
+            tmp_path = self._checkpoint_path(i, 'tmp.npy')
+            np.save(tmp_path, oob_pred)
+            os.replace(tmp_path, self._checkpoint_path(i, 'npy'))
+        tmp_path = self._checkpoint_path(i, 'tmp.txt')
+        model.save_model(tmp_path)
+        os.replace(tmp_path, self._checkpoint_path(i, 'txt'))
+
+    def bag_index_labels(self, i):
+        """第i个子模型采样到的U集样本的原始索引"""
+        return self.u_index_[self.bag_indices_[i]]
+
+    def oob_predict_proba(self):
+        """
+        U集样本的袋外违约概率（只由训练时未采样到该样本的子模型打分后取平均）
+        return: 以U集原始索引为索引的Series，从未落在袋外的样本为NaN
+        """
+        if self.oob_sum_ is None:
+            raise ValueError("未累积袋外概率，请设置oob_score=True后重新调用fit()方法")
+        with np.errstate(invalid='ignore', divide='ignore'):
+            oob_proba = self.oob_sum_ / self.oob_count_
+        return pd.Series(oob_proba, index=self.u_index_)
+
+    def _add_oob(self, i, oob_pred):
+        mask = self._oob_mask(i)
+        self.oob_sum_[mask] += oob_pred
+        self.oob_count_[mask] += 1
+
+    def _collect_models(self, bag_ids, results, checkpoint=True):
+        """收集训练结果；自适应模式下收敛时返回True并停止收集"""
+        for i, (model, oob_pred, stats) in zip(bag_ids, results):
+            if self.telemetry_path:
+                self._write_telemetry(stats)
+            # 增量刷新时替换原位置的子模型，否则追加
+            if i < len(self.models):
+                self.models[i] = model
+            else:
+                self.models.append(model)
+            if oob_pred is not None:
+                self._add_oob(i, oob_pred)
+            if self.checkpoint_dir and checkpoint:
+                self._save_checkpoint(i, model, oob_pred)
 
             if (i + 1) % 10 == 0:
                 print(f"已完成 {i + 1}/{self.n_estimators} 个模型")
 
-    def predict_proba(self, X):
+            if self._monitor is not None and self._update_monitor(model):
+                return True
+        return False
+
+    def _write_telemetry(self, stats):
+        """把一个子模型的训练记录追加为一行JSON（主进程按子模型顺序写入）"""
+        record = dict(self.telemetry_run_ or {}, timestamp=time.strftime('%Y-%m-%d %H:%M:%S'), **stats)
+        os.makedirs(os.path.dirname(os.path.abspath(self.telemetry_path)), exist_ok=True)
+        with open(self.telemetry_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False, default=float) + '\n')
+
+    def predict_proba(self, X, chunk_size=100000, n_threads=-1):
         """
         预测每个样本的违约风险概率（0~1，值越大违约风险越高）
         X: 待预测样本特征（需与训练特征一致）
-        return: 每个样本的违约概率数组
+        chunk_size: 每次送入全部子模型的行数，内存占用只与该值相关，与X的总行数无关
+        n_threads: 每个子模型预测时使用的线程数，-1为当前进程的全部线程预算
+        return: 每个样本的违约概率数组（float32）
         """
         if not self.models:
             raise ValueError("模型未训练，请先调用fit()方法")
 
-        # 确保特征顺序一致
-        X = X[self.feature_names]
+        n_rows = len(X)
+        avg_preds = np.empty(n_rows, dtype=np.float32)
+        for start in range(0, n_rows, chunk_size):
+            # 按块取行并确保特征顺序一致，只复制当前块
+            X_chunk = _feature_matrix(X.iloc[start:start + chunk_size][self.feature_names])
 
-        # 收集所有子模型的预测概率
-        all_preds = []
-        for model in self.models:
-            # LightGBM预测正类（违约）概率
-            pred = model.predict(X, num_iteration=model.best_iteration)
-            all_preds.append(pred)
-
-        # 对所有子模型的概率取平均（Bagging融合）
-        avg_preds = np.mean(all_preds, axis=0)
+            # 所有子模型的预测概率直接累加到同一个float32累加器上（Bagging融合）
+            acc = np.zeros(len(X_chunk), dtype=np.float32)
+            for model in self.models:
+                # LightGBM预测正类（违约）概率
+                acc += model.predict(X_chunk, num_iteration=model.best_iteration, num_threads=resolve_threads(n_threads))
+            avg_preds[start:start + chunk_size] = acc / len(self.models)
         return avg_preds
 
+    def predict_decision(self, X, threshold=0.9, min_models=10, z=3.0, chunk_size=100000, n_threads=-1):
+        """
+        提前退出的阈值判定：按顺序逐个子模型打分，某行的平均概率一旦确定落在阈值一侧即停止对该行打分，
+        只有阈值附近的样本才计算全部子模型的精确平均
+        X: 待预测样本特征
+        threshold: 判定阈值，判定结果为 平均违约概率 >= threshold
+        min_models: 每行至少使用的子模型个数
+        z: 统计界的置信倍数（运行均值 ± z × 标准误，含有限总体修正）；None表示只使用精确界
+           （剩余子模型全部给出0或1时的平均值范围），此时判定结果与predict_proba完全一致
+        return: (判定结果bool数组, 概率估计float32数组（提前退出的行为运行均值）, 每行实际使用的子模型个数)
+        """
+        if not self.models:
+            raise ValueError("模型未训练，请先调用fit()方法")
+
+        n_models = len(self.models)
+        n_rows = len(X)
+        decisions = np.zeros(n_rows, dtype=bool)
+        proba = np.empty(n_rows, dtype=np.float32)
+        n_evaluated = np.full(n_rows, n_models, dtype=np.int32)
+        for start in range(0, n_rows, chunk_size):
+            X_chunk = _feature_matrix(X.iloc[start:start + chunk_size][self.feature_names])
+            active = np.arange(len(X_chunk))
+            pred_sum = np.zeros(len(X_chunk))
+            pred_sq_sum = np.zeros(len(X_chunk))
+
+            for k, model in enumerate(self.models, 1):
+                pred = model.predict(X_chunk[active], num_iteration=model.best_iteration,
+                                     num_threads=resolve_threads(n_threads))
+                pred_sum[active] += pred
+                pred_sq_sum[active] += pred * pred
+                if k < min_models or k == n_models:
+                    continue
+
+                s_active = pred_sum[active]
+                mean = s_active / k
+                # 精确界：剩余子模型的概率都在[0,1]之间
+                lower = s_active / n_models
+                upper = (s_active + (n_models - k)) / n_models
+                if z is not None:
+                    var = np.maximum(pred_sq_sum[active] / k - mean * mean, 0) * k / (k - 1)
+                    half_width = z * np.sqrt(var / k * (n_models - k) / (n_models - 1))
+                    lower = np.maximum(lower, mean - half_width)
+                    upper = np.minimum(upper, mean + half_width)
+
+                above, below = lower >= threshold, upper < threshold
+                done = above | below
+                if done.any():
+                    rows = active[done]
+                    decisions[start + rows] = above[done]
+                    proba[start + rows] = mean[done]
+                    n_evaluated[start + rows] = k
+                    active = active[~done]
+                if len(active) == 0:
+                    break
+
+            # 未提前退出的行使用全部子模型的精确平均
+            if len(active) > 0:
+                exact = pred_sum[active] / n_models
+                decisions[start + active] = exact >= threshold
+                proba[start + active] = exact
+        print(f"提前退出打分: 平均每行使用 {n_evaluated.mean():.1f}/{n_models} 个子模型")
+        return decisions, proba, n_evaluated
+
+    def save(self, path):
+        """
+        把整个集成模型保存为单个文件：子模型、特征名、预处理配置、采样行号及袋外概率
+        path: 模型文件路径
+        """
+        if not self.models:
+            raise ValueError("模型未训练，请先调用fit()方法")
+        artifact = {
+            'format_version': MODEL_FORMAT_VERSION,
+            'ensemble_version': self.ensemble_version_,
+            'params': self.get_params(),
+            'feature_names': self.feature_names,
+            'preprocess_config': self.preprocess_config,
+            'preprocess_plan': self.preprocess_plan.to_dict() if self.preprocess_plan is not None else None,
+            'bag_indices': self.bag_indices_,
+            'u_index': self.u_index_,
+            'seen_u_index': self.seen_u_index_,
+            'oob_sum': self.oob_sum_,
+            'oob_count': self.oob_count_,
+            'fingerprint': self.fingerprint_,
+            'n_refreshes': self.n_refreshes_,
+            'convergence_history': self.convergence_history_,
+            'convergence': self.convergence_,
+            'pruned_from': self.pruned_from_,
+            'pruned_indices': self.pruned_indices_,
+            'fidelity': self.fidelity_,
+            # 子模型以LightGBM文本格式保存，加载时直接解析，无需重新训练
+            'boosters': [model.model_to_string() for model in self.models]
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'wb') as f:
+            pickle.dump(artifact, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        """从save()保存的模型文件恢复集成模型"""
+        with open(path, 'rb') as f:
+            artifact = pickle.load(f)
+        if artifact.get('format_version') != MODEL_FORMAT_VERSION:
+            raise ValueError(
+                "模型文件格式版本不兼容: {}（当前支持 {}）".format(artifact.get('format_version'), MODEL_FORMAT_VERSION)
+            )
+
+        model = cls(**artifact['params'])
+        model.ensemble_version_ = artifact['ensemble_version']
+        model.feature_names = artifact['feature_names']
+        model.preprocess_config = artifact['preprocess_config']
+        if artifact.get('preprocess_plan') is not None:
+            model.preprocess_plan = PreprocessPlan.from_dict(artifact['preprocess_plan'])
+        model.bag_indices_ = artifact['bag_indices']
+        model.u_index_ = artifact['u_index']
+        model.seen_u_index_ = artifact.get('seen_u_index')
+        model.oob_sum_ = artifact['oob_sum']
+        model.oob_count_ = artifact['oob_count']
+        model.fingerprint_ = artifact.get('fingerprint')
+        model.n_refreshes_ = artifact.get('n_refreshes', 0)
+        model.convergence_history_ = artifact.get('convergence_history', [])
+        model.convergence_ = artifact.get('convergence')
+        model.pruned_from_ = artifact.get('pruned_from')
+        model.pruned_indices_ = artifact.get('pruned_indices')
+        model.fidelity_ = artifact.get('fidelity')
+        model.models = [lgb.Booster(model_str=booster) for booster in artifact['boosters']]
+        model.n_estimators_ = len(model.models)
+        return model
+
+    def distill(self, X, holdout_ratio=0.2, num_boost_round=1000, early_stopping_rounds=50, top_k=100,
+                n_threads=-1):
+        """
+        知识蒸馏：以集成模型的平均违约概率为软标签，训练单个LightGBM回归模型用于快速打分
+        X: 蒸馏用样本特征（建议使用全量打分人群）
+        holdout_ratio: 留出评估保真度（并用于早停）的样本比例
+        top_k: 保真度评估中前k个高风险样本重合度的k
+        return: DistilledPUModel，fidelity_ 中记录留出集上与集成模型的排序一致性
+        """
+        if not self.models:
+            raise ValueError("模型未训练，请先调用fit()方法")
+        teacher_proba = self.predict_proba(X, n_threads=n_threads)
+        X_values = _feature_matrix(X[self.feature_names])
+        categorical_positions = _categorical_positions(X[self.feature_names]) or 'auto'
+
+        rng = np.random.default_rng(self.random_seed)
+        perm = rng.permutation(len(X_values))
+        n_holdout = max(1, int(len(X_values) * holdout_ratio))
+        holdout_idx, train_idx = np.sort(perm[:n_holdout]), np.sort(perm[n_holdout:])
+
+        params = {
+            # cross_entropy 目标直接拟合[0,1]之间的软标签，输出即为概率
+            'objective': 'cross_entropy',
+            'metric': 'cross_entropy',
+            'verbosity': -1,
+            'learning_rate': 0.05,
+            'num_leaves': 63,
+            'min_child_samples': 20,
+            'colsample_bytree': 0.8,
+            'n_jobs': resolve_threads(n_threads),
+            'seed': self.random_seed
+        }
+        dtrain = lgb.Dataset(
+            X_values[train_idx], label=teacher_proba[train_idx], categorical_feature=categorical_positions
+        )
+        dvalid = lgb.Dataset(X_values[holdout_idx], label=teacher_proba[holdout_idx], reference=dtrain)
+        print(f"开始蒸馏: 训练样本 {len(train_idx)} 个, 留出样本 {len(holdout_idx)} 个")
+        booster = lgb.train(
+            params, dtrain, num_boost_round=num_boost_round, valid_sets=[dvalid],
+            callbacks=[lgb.early_stopping(early_stopping_rounds, verbose=False)]
+        )
+        booster = lgb.Booster(model_str=booster.model_to_string(num_iteration=booster.best_iteration))
+
+        student = DistilledPUModel(
+            booster, self.feature_names, self.ensemble_version_, self.preprocess_config, self.preprocess_plan
+        )
+        student_proba = student.predict_proba(X.iloc[holdout_idx], n_threads=n_threads)
+        student.fidelity_ = ranking_fidelity(teacher_proba[holdout_idx], student_proba, top_k)
+        student.fidelity_['n_trees'] = booster.num_trees()
+        print("蒸馏模型保真度: Spearman={spearman:.4f}, Top{top_k}重合度={topk_overlap:.4f}, "
+              "平均绝对误差={mean_abs_diff:.6f}, 树的数量={n_trees}".format(**student.fidelity_))
+        return student
+
+    def prune(self, X_val, n_keep=30, top_k=100, n_threads=-1):
+        """
+        集成剪枝：贪心地逐个挑选子模型，使所选子模型的平均得分与完整集成在验证样本上的排序最一致
+        X_val: 验证样本特征
+        n_keep: 保留的子模型个数
+        return: 剪枝后的BaggingPULeaning，pruned_indices_ 记录保留的子模型编号，fidelity_ 记录排序一致性
+        """
+        if not self.models:
+            raise ValueError("模型未训练，请先调用fit()方法")
+        n_keep = min(n_keep, len(self.models))
+        X_values = _feature_matrix(X_val[self.feature_names])
+
+        # 各子模型在验证样本上的预测矩阵 (n_models, n_val)
+        preds = np.empty((len(self.models), len(X_values)), dtype=np.float32)
+        for i, model in enumerate(self.models):
+            preds[i] = model.predict(X_values, num_iteration=model.best_iteration, num_threads=resolve_threads(n_threads))
+        full_mean = preds.mean(axis=0)
+        full_rank = _standardize(np.argsort(np.argsort(full_mean)).astype(np.float64))
+
+        print(f"开始集成剪枝: 从 {len(self.models)} 个子模型中选取 {n_keep} 个")
+        selected = []
+        selected_sum = np.zeros(len(X_values), dtype=np.float64)
+        remaining = np.arange(len(self.models))
+        for step in range(n_keep):
+            # 所有候选子模型加入后的平均得分，批量计算秩并与完整集成的秩求相关（Spearman）
+            candidate_mean = (selected_sum + preds[remaining]) / (step + 1)
+            candidate_rank = np.argsort(np.argsort(candidate_mean, axis=1), axis=1).astype(np.float64)
+            corr = _standardize(candidate_rank, axis=1) @ full_rank / len(full_rank)
+            best = int(np.argmax(corr))
+            selected.append(int(remaining[best]))
+            selected_sum += preds[remaining[best]]
+            remaining = np.delete(remaining, best)
+
+        pruned = copy.copy(self)
+        pruned.models = [self.models[i] for i in selected]
+        pruned.n_estimators = pruned.n_estimators_ = len(selected)
+        pruned.bag_indices_ = self.bag_indices_[selected] if self.bag_indices_ is not None else None
+        if self.seen_u_index_ is not None:
+            pruned.seen_u_index_ = [self.seen_u_index_[i] for i in selected]
+        # 袋外概率、指纹与版本号对应完整集成，剪枝后不再适用
+        pruned.oob_sum_ = pruned.oob_count_ = None
+        pruned.fingerprint_ = None
+        pruned.ensemble_version_ = None
+        pruned.pruned_from_ = self.ensemble_version_
+        pruned.pruned_indices_ = selected
+        pruned.fidelity_ = ranking_fidelity(full_mean, selected_sum / len(selected), top_k)
+        print("剪枝后保真度: Spearman={spearman:.4f}, Top{top_k}重合度={topk_overlap:.4f}, "
+              "平均绝对误差={mean_abs_diff:.6f}".format(**pruned.fidelity_))
+        return pruned
+
+class DistilledPUModel:
+    """蒸馏得到的单模型打分器，接口与BaggingPULeaning.predict_proba一致，可直接替换"""
+    def __init__(self, booster, feature_names, ensemble_version=None, preprocess_config=None, preprocess_plan=None):
+        self.booster = booster
+        self.feature_names = feature_names
+        # 蒸馏来源的集成模型版本及其预处理配置/方案
+        self.ensemble_version_ = ensemble_version
+        self.preprocess_config = preprocess_config
+        self.preprocess_plan = preprocess_plan
+        self.fidelity_ = None
+
+    def predict_proba(self, X, chunk_size=100000, n_threads=-1):
+        """预测每个样本的违约风险概率，return: float32数组"""
+        n_rows = len(X)
+        preds = np.empty(n_rows, dtype=np.float32)
+        for start in range(0, n_rows, chunk_size):
+            X_chunk = _feature_matrix(X.iloc[start:start + chunk_size][self.feature_names])
+            preds[start:start + chunk_size] = self.booster.predict(X_chunk, num_threads=resolve_threads(n_threads))
+        return preds
+
+    def save(self, path):
+        artifact = {
+            'format_version': MODEL_FORMAT_VERSION,
+            'ensemble_version': self.ensemble_version_,
+            'feature_names': self.feature_names,
+            'preprocess_config': self.preprocess_config,
+            'preprocess_plan': self.preprocess_plan.to_dict() if self.preprocess_plan is not None else None,
+            'fidelity': self.fidelity_,
+            'booster': self.booster.model_to_string()
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'wb') as f:
+            pickle.dump(artifact, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            artifact = pickle.load(f)
+        if artifact.get('format_version') != MODEL_FORMAT_VERSION:
+            raise ValueError(
+                "模型文件格式版本不兼容: {}（当前支持 {}）".format(artifact.get('format_version'), MODEL_FORMAT_VERSION)
+            )
+        model = cls(
+            lgb.Booster(model_str=artifact['booster']), artifact['feature_names'],
+            artifact['ensemble_version'], artifact['preprocess_config'],
+            PreprocessPlan.from_dict(artifact['preprocess_plan']) if artifact.get('preprocess_plan') else None
+        )
+        model.fidelity_ = artifact['fidelity']
+        return model
+
+def _standardize(values, axis=None):
+    """按指定轴标准化为零均值、单位方差（方差为0时保持为0）"""
+    mean = values.mean(axis=axis, keepdims=axis is not None)
+    std = values.std(axis=axis, keepdims=axis is not None)
+    return (values - mean) / np.where(std > 0, std, 1)
+
+def ranking_fidelity(reference, candidate, top_k=100):
+    """
+    评估候选得分与参考得分的排序一致性
+    return: dict，包含Spearman秩相关、前top_k重合度与平均绝对误差
+    """
+    reference = np.asarray(reference, dtype=np.float64)
+    candidate = np.asarray(candidate, dtype=np.float64)
+    k = min(top_k, len(reference))
+    ref_top = np.argpartition(-reference, k - 1)[:k]
+    cand_top = np.argpartition(-candidate, k - 1)[:k]
+    return {
+        'spearman': float(pd.Series(reference).corr(pd.Series(candidate), method='spearman')),
+        'topk_overlap': len(np.intersect1d(ref_top, cand_top)) / k,
+        'top_k': k,
+        'mean_abs_diff': float(np.mean(np.abs(reference - candidate)))
+    }
+
+def data_fingerprint(*data):
+    """计算若干DataFrame/Series/数组内容（含索引与列名）的指纹"""
+    h = hashlib.sha1()
+    for obj in data:
+        if isinstance(obj, (pd.DataFrame, pd.Series)):
+            h.update(pd.util.hash_pandas_object(obj, index=True).to_numpy().tobytes())
+            if isinstance(obj, pd.DataFrame):
+                h.update(json.dumps([str(col) for col in obj.columns]).encode('utf-8'))
+        else:
+            h.update(np.ascontiguousarray(obj).tobytes())
+    return h.hexdigest()
+
+def save_to_store(model, store_dir=MODEL_STORE_DIR, version=None, update_latest=True):
+    """
+    把模型保存到模型仓库，并更新latest指针
+    version: 模型版本号，None时按当前时间生成
+    update_latest: 是否把该版本设为最新版本
+    return: 模型版本号
+    """
+    if version is None:
+        version = time.strftime('%Y%m%d_%H%M%S')
+    model.ensemble_version_ = version
+    model.save(os.path.join(store_dir, f'pu_ensemble_{version}.pkl'))
+    if update_latest:
+        with open(os.path.join(store_dir, 'latest.json'), 'w', encoding='utf-8') as f:
+            json.dump({'version': version}, f, ensure_ascii=False, indent=4)
+    print(f"模型已保存到模型仓库: {store_dir}（版本 {version}）")
+    return version
+
+def load_from_store(store_dir=MODEL_STORE_DIR, version=None):
+    """从模型仓库加载指定版本的模型，version为None时加载最新版本"""
+    if version is None:
+        latest_path = os.path.join(store_dir, 'latest.json')
+        if not os.path.exists(latest_path):
+            raise FileNotFoundError(f"模型仓库中没有已保存的模型: {store_dir}")
+        with open(latest_path, 'r', encoding='utf-8') as f:
+            version = json.load(f)['version']
+    model = BaggingPULeaning.load(os.path.join(store_dir, f'pu_ensemble_{version}.pkl'))
+    print(f"已加载模型版本 {version}（共{len(model.models)}个子模型）")
+    return model
+
+def row_fingerprints(X):
+    """每行特征向量的64位指纹（与行索引无关），特征完全相同的行指纹相同"""
+    return pd.util.hash_pandas_object(X, index=False).to_numpy()
+
+def predict_proba_incremental(model, X, cache_dir=SCORE_CACHE_DIR, n_threads=-1):
+    """
+    增量打分：同一模型版本下，特征未变化的行直接复用上次的概率，只对新增或变化的行打分
+    model: 已保存到模型仓库（有ensemble_version_）的BaggingPULeaning或DistilledPUModel；无版本号时全部重新打分
+    X: 待预测样本特征
+    cache_dir: 缓存目录，每个模型版本一个文件，内容为本次全部行的指纹与概率（不再出现的行随之淘汰）
+    return: 每个样本的违约概率数组（float32）
+    """
+    version = getattr(model, 'ensemble_version_', None)
+    if version is None:
+        print("模型没有版本号，无法复用缓存，全部重新打分")
+        return model.predict_proba(X, n_threads=n_threads)
+
+    hashes = row_fingerprints(X[model.feature_names])
+    cache_path = os.path.join(cache_dir, f'scores_{type(model).__name__}_{version}.npz')
+    proba = np.full(len(X), np.nan, dtype=np.float32)
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as cache:
+            positions = pd.Index(cache['row_hash']).get_indexer(hashes)
+            hit = positions >= 0
+            proba[hit] = cache['proba'][positions[hit]]
+
+    todo = np.flatnonzero(np.isnan(proba))
+    print(f"增量打分: 复用缓存 {len(X) - len(todo)} 行，重新打分 {len(todo)} 行")
+    if len(todo) > 0:
+        proba[todo] = model.predict_proba(X.iloc[todo], n_threads=n_threads)
+
+    # 缓存只保留本次出现的行（同一特征向量只存一份）
+    unique_hashes, first = np.unique(hashes, return_index=True)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = cache_path + '.tmp.npz'
+    np.savez(tmp_path, row_hash=unique_hashes, proba=proba[first])
+    os.replace(tmp_path, cache_path)
+    return proba
+
+class PreprocessPlan:
+    """
+    可拟合的预处理方案：fit时记录分类编码表与中位数等统计量，transform时按列一次性构造结果，
+    不整表复制；编码表随模型一起保存，保证训练与打分时的编码一致
+    参数与preprocess_dataframe相同
+    """
+    def __init__(self, categorical_mappings=None, binary_mappings=None, text_columns=None, custom_transforms=None,
+                 native_categorical=False, max_native_categories=255, high_cardinality_mappings=None):
+        self.categorical_mappings = categorical_mappings or []
+        self.binary_mappings = binary_mappings or []
+        self.text_columns = text_columns or []
+        self.custom_transforms = custom_transforms or []
+        self.high_cardinality_mappings = high_cardinality_mappings or []
+        # True时分类列输出为类别固定的pandas category（供LightGBM/XGBoost按原生分类特征处理），否则输出整数编码；
+        # 类别数超过max_native_categories的列按原生分类处理代价很高，仍输出整数编码
+        self.native_categorical = native_categorical
+        self.max_native_categories = max_native_categories
+        # 分类列 -> 类别取值列表（编码即为取值在列表中的位置，缺失或未见过的取值编码为-1）
+        self.category_values_ = {}
+        # year_imputation 列 -> 训练数据中位数
+        self.medians_ = {}
+        # 高基数列（frequency/count编码）-> {'values': 取值列表, 'counts': 各取值出现次数, 'n_rows': 训练行数}
+        self.frequency_tables_ = {}
+        self.fitted = False
+
+    def fit(self, df):
+        """在训练数据上记录分类编码表与填充用的中位数"""
+        for col_config in self.categorical_mappings:
+            col_name = col_config.get('column')
+            if col_name in df.columns:
+                # 与pd.factorize一致：按首次出现顺序编码
+                self.category_values_[col_name] = pd.factorize(df[col_name])[1].tolist()
+
+        for col_config in self.high_cardinality_mappings:
+            col_name = col_config.get('column')
+            if col_name in df.columns and col_config.get('method', 'frequency') in ('frequency', 'count'):
+                codes, uniques = pd.factorize(df[col_name])
+                self.frequency_tables_[col_name] = {
+                    'values': uniques.tolist(),
+                    'counts': np.bincount(codes[codes >= 0], minlength=len(uniques)).tolist(),
+                    'n_rows': len(df)
+                }
+
+        columns = {}
+        for transform_config in self.custom_transforms:
+            col_name = transform_config.get('column')
+            if col_name not in df.columns:
+                continue
+            series = columns.get(col_name, self._binary_column(df, col_name))
+            if transform_config.get('type') == 'year_imputation':
+                self.medians_[col_name] = pd.to_numeric(series, errors='coerce').median()
+            columns[col_name] = self._custom_column(series, col_name, transform_config)
+        self.fitted = True
+        return self
+
+    def transform(self, df):
+        """按拟合好的方案处理数据，返回新的DataFrame，不修改输入"""
+        if not self.fitted:
+            raise ValueError("预处理方案未拟合，请先调用fit()方法")
+        drop_columns = set(col for col in self.text_columns)
+        encoded = {}
+
+        # 1. 处理分类变量（按训练时的编码表编码）
+        for col_config in self.categorical_mappings:
+            col_name = col_config.get('column')
+            if col_name in df.columns and col_name in self.category_values_:
+                values = self.category_values_[col_name]
+                codes = self._encode_column(df[col_name], values)
+                if self.native_categorical and len(values) <= self.max_native_categories:
+                    codes = pd.Categorical.from_codes(codes, categories=values)
+                encoded[f"{col_name}_encoded"] = codes
+                if col_config.get('drop_original', False):
+                    drop_columns.add(col_name)
+
+        # 1.1 高基数列：按出现频率/次数或特征哈希编码，避免近乎唯一的整数编码
+        for col_config in self.high_cardinality_mappings:
+            col_name = col_config.get('column')
+            method = col_config.get('method', 'frequency')
+            if col_name in df.columns and (method == 'hash' or col_name in self.frequency_tables_):
+                encoded[f"{col_name}_{method}"] = self._high_cardinality_column(df[col_name], col_name, col_config)
+                if col_config.get('drop_original', False):
+                    drop_columns.add(col_name)
+
+        # 2~3. 二值映射与自定义转换只作用于对应列，其余列原样引用
+        columns = {}
+        for col_config in self.binary_mappings:
+            col_name = col_config.get('column')
+            if col_name in df.columns:
+                columns[col_name] = self._binary_column(df, col_name)
+        for transform_config in self.custom_transforms:
+            col_name = transform_config.get('column')
+            if col_name in df.columns:
+                series = columns.get(col_name, df[col_name])
+                columns[col_name] = self._custom_column(series, col_name, transform_config)
+
+        # 4. 删除文本列，一次性组装结果（编码列追加在末尾）
+        result = {
+            col: columns.get(col, df[col]) for col in df.columns if col not in drop_columns
+        }
+        for col_name, codes in encoded.items():
+            if col_name not in drop_columns:
+                result[col_name] = codes
+        return pd.DataFrame(result, index=df.index, copy=False)
+
+    def fit_transform(self, df):
+        return self.fit(df).transform(df)
+
+    @staticmethod
+    def _encode_column(series, values):
+        # 把已知类别放在最前面一起factorize，已知类别的编码即其在编码表中的位置，新类别编码置为-1
+        known = pd.Series(values)
+        codes = pd.factorize(pd.concat([known, series], ignore_index=True))[0][len(known):]
+        codes[codes >= len(known)] = -1
+        return codes
+
+    def _high_cardinality_column(self, series, col_name, col_config):
+        method = col_config.get('method', 'frequency')
+        if method == 'hash':
+            # 特征哈希：取值的稳定哈希对桶数取模，无需保存取值表；缺失为NaN
+            n_buckets = col_config.get('n_buckets', 1024)
+            buckets = pd.util.hash_array(series.astype(object).to_numpy()) % np.uint64(n_buckets)
+            return np.where(series.isna().to_numpy(), np.nan, buckets.astype(np.float32))
+
+        # 频率/次数编码：训练数据中未出现的取值与缺失值均记为0
+        table = self.frequency_tables_[col_name]
+        codes = self._encode_column(series, table['values'])
+        counts = np.append(np.asarray(table['counts'], dtype=np.float32), np.float32(0))[codes]
+        if method == 'frequency':
+            return counts / np.float32(table['n_rows'])
+        return counts
+
+    def _binary_column(self, df, col_name):
+        for col_config in self.binary_mappings:
+            if col_config.get('column') == col_name:
+                mapping = col_config.get('mapping')
+                default_value = col_config.get('default', np.nan)
+                # 应用映射并转换为数值类型
+                return pd.to_numeric(df[col_name].map(mapping).fillna(default_value), errors='coerce')
+        return df[col_name]
+
+    def _custom_column(self, series, col_name, transform_config):
+        transform_type = transform_config.get('type')
+        params = transform_config.get('params', {})
+        if transform_type == 'year_imputation':
+            # 年份数据处理（转换并用训练数据的中位数填充）
+            series = pd.to_numeric(series, errors='coerce')
+            return series.fillna(self.medians_.get(col_name, series.median()))
+        return _custom_transform_series(series, transform_type, params)
+
+    def to_dict(self):
+        """可序列化的方案内容"""
+        return {
+            'categorical_mappings': self.categorical_mappings,
+            'binary_mappings': self.binary_mappings,
+            'text_columns': self.text_columns,
+            'custom_transforms': self.custom_transforms,
+            'high_cardinality_mappings': self.high_cardinality_mappings,
+            'native_categorical': self.native_categorical,
+            'max_native_categories': self.max_native_categories,
+            'category_values': self.category_values_,
+            'medians': self.medians_,
+            'frequency_tables': self.frequency_tables_
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        plan = cls(
+            state['categorical_mappings'], state['binary_mappings'], state['text_columns'], state['custom_transforms'],
+            state.get('native_categorical', False), state.get('max_native_categories', 255),
+            state.get('high_cardinality_mappings')
+        )
+        plan.category_values_ = state['category_values']
+        plan.medians_ = state['medians']
+        plan.frequency_tables_ = state.get('frequency_tables', {})
+        plan.fitted = True
+        return plan
+
 def preprocess_dataframe(df,
                          categorical_mappings=None,
                          binary_mappings=None,
                          text_columns=None,
-                         custom_transforms=None):
+                         custom_transforms=None,
+                         native_categorical=False,
+                         high_cardinality_mappings=None):
     """
-    通用数据预处理函数
+    通用数据预处理函数（在df自身上拟合并转换；需要训练/打分编码一致时使用PreprocessPlan）
     参数:
     df: 原始DataFrame
     categorical_mappings: 分类列映射配置
     binary_mappings: 二值列映射配置
     text_columns: 文本列配置（将被删除）
     custom_transforms: 自定义转换配置
+    native_categorical: 分类列保留为pandas category（原生分类特征），否则为整数编码
+    high_cardinality_mappings: 高基数列编码配置（method为frequency/count/hash）
     返回:
     预处理后的DataFrame
     """
-    df_processed = df.copy()
-
-    # 1. 处理分类变量（因子化编码）
-    if categorical_mappings:
-        for col_config in categorical_mappings:
-            col_name = col_config.get('column')
-            drop_original = col_config.get('drop_original', False)
-
-            if col_name in df_processed.columns:
-                # 创建因子化列
-                codes, uniques = pd.factorize(df_processed[col_name])
-                df_processed[f"{col_name}_encoded"] = codes
+    return PreprocessPlan(
+        categorical_mappings, binary_mappings, text_columns, custom_transforms, native_categorical,
+        high_cardinality_mappings=high_cardinality_mappings
+    ).fit_transform(df)
 
-                # 如果需要，删除原始列
-                if drop_original:
-                    df_processed = df_processed.drop(columns=[col_name])
-
-    # 2. 处理二值变量
-    if binary_mappings:
-        for col_config in binary_mappings:
-            col_name = col_config.get('column')
-            mapping = col_config.get('mapping')
-            default_value = col_config.get('default', np.nan)
-
-            if col_name in df_processed.columns:
-                # 应用映射
-                df_processed[col_name] = df_processed[col_name].map(mapping).fillna(default_value)
-                # 转换为数值类型
-                df_processed[col_name] = pd.to_numeric(df_processed[col_name], errors='coerce')
-
-    # 3. 处理自定义转换
-    if custom_transforms:
-        for transform_config in custom_transforms:
-            col_name = transform_config.get('column')
-            transform_type = transform_config.get('type')
-            transform_params = transform_config.get('params', {})
-
-            if col_name in df_processed.columns:
-                df_processed = apply_custom_transform(
-                    df_processed, col_name, transform_type, transform_params
-                )
-
-    # 4. 删除文本列
-    if text_columns:
-        text_cols_to_drop = [col for col in text_columns if col in df_processed.columns]
-        if text_cols_to_drop:
-            df_processed = df_processed.drop(columns=text_cols_to_drop)
-
-    return df_processed
+def preprocess_for_model(model, df):
+    """按模型保存的预处理方案处理新数据；旧模型只有预处理配置时退回preprocess_dataframe"""
+    if getattr(model, 'preprocess_plan', None) is not None:
+        return model.preprocess_plan.transform(df)
+    return preprocess_dataframe(df, **(model.preprocess_config or {}))
 
 def apply_custom_transform(df, column, transform_type, params):
-    """应用自定义转换"""
-    df_copy = df.copy()
+    """应用自定义转换，只替换目标列"""
+    return df.assign(**{column: _custom_transform_series(df[column], transform_type, params)})
 
+def _custom_transform_series(series, transform_type, params):
+    """对单列应用自定义转换"""
     if transform_type == 'string_replace_convert':
         # 字符串替换并转换为数值
         search_str = params.get('search', "")
         replace_str = params.get('replace', "")
         divisor = params.get('divisor', 1)
-
-        df_copy[column] = (
-            df_copy[column]
-            .astype(str)
-            .str.replace(search_str, replace_str, regex=False)
-        )
-        df_copy[column] = pd.to_numeric(df_copy[column], errors='coerce') / divisor
+        series = series.astype(str).str.replace(search_str, replace_str, regex=False)
+        return pd.to_numeric(series, errors='coerce') / divisor
 
     elif transform_type == 'categorical_to_numeric':
         # 分类映射到数值
         mapping = params.get('mapping', {})
-        df_copy[column] = df_copy[column].map(mapping)
-        df_copy[column] = pd.to_numeric(df_copy[column], errors='coerce')
+        return pd.to_numeric(series.map(mapping), errors='coerce')
 
     elif transform_type == 'year_imputation':
         # 年份数据处理（转换并填充中位数）
-        df_copy[column] = pd.to_numeric(df_copy[column], errors='coerce')
-        median_value = df_copy[column].median()
-        df_copy[column] = df_copy[column].fillna(median_value)
+        series = pd.to_numeric(series, errors='coerce')
+        return series.fillna(series.median())
 
     elif transform_type == 'custom_mapping':
         # 通用映射转换
         mapping_func = params.get('mapping_func')
         if callable(mapping_func):
-            df_copy[column] = df_copy[column].apply(mapping_func)
+            return series.apply(mapping_func)
 
-    return df_copy
+    return series
 
 # 辅助函数：自动检测列类型
-def detect_column_types(df, sample_threshold=0.3):
-    """自动检测列的类型"""
+def _profile_column(series):
+    """单列统计：非空数、唯一值数、第一个非空值"""
+    codes, uniques = pd.factorize(series)
+    count = int((codes >= 0).sum())
+    first_value = uniques[0] if len(uniques) > 0 else None
+    return {'count': count, 'nunique': len(uniques), 'first_value': first_value}
+
+def profile_columns(df, n_workers=1, sample_rows=None, stratify_col='label', random_seed=42):
+    """
+    计算各列的类型判定统计量（非空数、唯一值数、第一个非空值）
+    n_workers: 并行统计的线程数，-1为使用全部CPU（factorize在C层执行，线程即可并行）
+    sample_rows: 行数超过该值时只统计分层抽样的样本（唯一值数按样本计，适用于超高的文件）
+    stratify_col: 分层抽样依据的列，不存在时简单随机抽样
+    return: {列名: 统计量}
+    """
+    if sample_rows is not None and len(df) > sample_rows:
+        frac = sample_rows / len(df)
+        if stratify_col in df.columns:
+            df = df.groupby(stratify_col, group_keys=False, dropna=False).sample(frac=frac, random_state=random_seed)
+            df = df.sort_index()
+        else:
+            df = df.sample(n=sample_rows, random_state=random_seed).sort_index()
+        print(f"列类型检测使用 {len(df)} 行抽样数据")
+
+    if n_workers == -1:
+        n_workers = available_threads()
+    columns = list(df.columns)
+    if n_workers <= 1:
+        stats = [_profile_column(df[col]) for col in columns]
+    else:
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            stats = list(executor.map(lambda col: _profile_column(df[col]), columns))
+    for col, col_stats in zip(columns, stats):
+        col_stats['dtype'] = df[col].dtype
+    return dict(zip(columns, stats))
+
+def detect_column_types(df, sample_threshold=0.3, n_workers=1, sample_rows=None, cache_dir=None,
+                        high_cardinality_threshold=1000, source_key=None):
+    """
+    自动检测列的类型
+    n_workers/sample_rows: 见profile_columns
+    high_cardinality_threshold: 非数值列唯一值数超过该值时归为高基数列（名称、编号等），不做整数编码
+    cache_dir: 检测结果缓存目录，按数据指纹缓存，同一份数据再次检测时直接读取
+    source_key: 数据来源的指纹（如data_loader.source_fingerprint），提供时不再对全表内容计算指纹
+    """
+    cache_path = None
+    if cache_dir is not None:
+        # 任一行取值变化都可能改变检测结果：优先使用数据文件的指纹（无需读取内容），否则对全表内容计算指纹
+        content_key = source_key if source_key is not None else data_fingerprint(df)
+        key = hashlib.sha1(json.dumps(
+            [content_key, list(df.shape), [str(t) for t in df.dtypes],
+             sample_threshold, sample_rows, high_cardinality_threshold]
+        ).encode('utf-8')).hexdigest()[:16]
+        cache_path = os.path.join(cache_dir, f'schema_{key}.json')
+        if os.path.exists(cache_path):
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                results = json.load(f)
+            print(f"使用缓存的列类型检测结果: {cache_path}")
+            with open('./pu_config.json', 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=4)
+            return results
+
     results = {
         'categorical': [],
         'binary': [],
         'text': [],
         'numeric': [],
-        'date': []
+        'date': [],
+        'high_cardinality': []
     }
 
-    for col in df.columns:
+    profiles = profile_columns(df, n_workers=n_workers, sample_rows=sample_rows)
+    for col, profile in profiles.items():
+        unique_count = profile['nunique']
+        total_count = profile['count']
+
         # 跳过全空列
-        if df[col].isna().all():
+        if total_count == 0:
             continue
 
         # 检测数据类型
-        dtype = str(df[col].dtype)
+        dtype = str(profile['dtype'])
 
         # 检测日期类型
         if 'date' in dtype.lower() or 'time' in dtype.lower():
@@ -211,48 +1442,58 @@ def detect_column_types(df, sample_threshold=0.3):
             continue
 
         # 检测数值类型
-        if pd.api.types.is_numeric_dtype(df[col]):
+        if pd.api.types.is_numeric_dtype(profile['dtype']):
             # 检查是否是二值变量
-            unique_values = df[col].dropna().unique()
-            if len(unique_values) == 2:
+            if unique_count == 2:
                 results['binary'].append(col)
             else:
                 results['numeric'].append(col)
             continue
 
         # 检测分类/文本类型
-        unique_count = df[col].nunique()
-        total_count = df[col].count()
-
-        if total_count > 0:
-            unique_ratio = unique_count / total_count
+        unique_ratio = unique_count / total_count
 
-            # 少量唯一值 => 分类变量
-            if unique_ratio < sample_threshold and unique_count < 50:
-                results['categorical'].append(col)
+        # 少量唯一值 => 分类变量
+        if unique_ratio < sample_threshold and unique_count < 50:
+            results['categorical'].append(col)
+        else:
+            # 大量唯一值或长文本 => 文本变量
+            sample_value = profile['first_value']
+            if isinstance(sample_value, str) and len(str(sample_value)) > 50:
+                results['text'].append(col)
+            elif unique_count > high_cardinality_threshold:
+                results['high_cardinality'].append(col)
             else:
-                # 大量唯一值或长文本 => 文本变量
-                sample_value = df[col].dropna().iloc[0] if not df[col].dropna().empty else ""
-                if isinstance(sample_value, str) and len(str(sample_value)) > 50:
-                    results['text'].append(col)
-                else:
-                    results['categorical'].append(col)
+                results['categorical'].append(col)
 
     print('categorical len:' + str(len(results['categorical'])))
+    print('high_cardinality len:' + str(len(results['high_cardinality'])))
     print('binary len:' + str(len(results['binary'])))
     print('numeric len:' + str(len(results['numeric'])))
     print('date len:' + str(len(results['date'])))
 
     with open('./pu_config.json', 'w', encoding='utf-8') as f:
         json.dump(results, f, ensure_ascii=False, indent=4)
+    if cache_path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = cache_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, cache_path)
 
     return results
 
 # 自动配置生成
-def generate_config_from_data(df, unique_ratio_threshold=0.3):
-    """根据数据自动生成预处理配置"""
+def generate_config_from_data(df, unique_ratio_threshold=0.3, n_workers=1, sample_rows=None, cache_dir=None,
+                              high_cardinality_threshold=1000, high_cardinality_method='frequency', source_key=None):
+    """
+    根据数据自动生成预处理配置（n_workers/sample_rows/cache_dir/high_cardinality_threshold/source_key 见detect_column_types）
+    high_cardinality_method: 高基数列的编码方式，'frequency'/'count'/'hash'
+    """
     print('自动生成数据格式配置文件')
-    column_types = detect_column_types(df, unique_ratio_threshold)
+    column_types = detect_column_types(
+        df, unique_ratio_threshold, n_workers, sample_rows, cache_dir, high_cardinality_threshold, source_key
+    )
 
     config = {
         'categorical_mappings': [
@@ -268,7 +1509,11 @@ def generate_config_from_data(df, unique_ratio_threshold=0.3):
             for col in column_types['binary']
         ],
         'text_columns': column_types['text'],
-        'custom_transforms': []
+        'custom_transforms': [],
+        'high_cardinality_mappings': [
+            {'column': col, 'method': high_cardinality_method, 'drop_original': True}
+            for col in column_types.get('high_cardinality', [])
+        ]
     }
 
     return config
@@ -285,25 +1530,29 @@ def create_binary_mapping(series):
     return mapping
 
 # 主处理流程
-def process_pipeline(df, auto_config=False, custom_config=None):
+def process_pipeline(df, auto_config=False, custom_config=None, plan=None):
     """
     完整的预处理流水线
     参数:
     df: 原始数据
     auto_config: 是否自动生成配置
     custom_config: 自定义配置（如果提供则优先使用）
+    plan: 已拟合的PreprocessPlan（如果提供则直接用它转换，保证与训练时编码一致）
     """
-    # 步骤1: 生成或使用配置
-    if custom_config:
-        config = custom_config
-    elif auto_config:
-        config = generate_config_from_data(df)
+    if plan is not None:
+        processed_df = plan.transform(df)
     else:
-        # 使用默认配置
-        config = {}
+        # 步骤1: 生成或使用配置
+        if custom_config:
+            config = custom_config
+        elif auto_config:
+            config = generate_config_from_data(df)
+        else:
+            # 使用默认配置
+            config = {}
 
-    # 步骤2: 数据预处理
-    processed_df = preprocess_dataframe(df, **config)
+        # 步骤2: 数据预处理
+        processed_df = preprocess_dataframe(df, **config)
 
     # 步骤3: 可选的质量检查
     print(f"原始数据形状: {df.shape}")
@@ -318,26 +1567,20 @@ def process_pipeline(df, auto_config=False, custom_config=None):
 
     return processed_df
 
-if __name__ == "__main__":
-    import pandas as pd
-    df = pd.read_csv(r'data/train.csv')
-    print(f"加载数据: {df.shape}")
-    print(f"列名: {list(df.columns)}")
-
-    df_processed = df.copy()
-    processed_df1 = process_pipeline(df_processed, auto_config=True)
-    print(f"\n处理后列名: {list(processed_df1.columns)}")
-    print("\n处理后的数据类型:")
-    print(processed_df1.dtypes.value_counts())
-
-    # 构建PU场景
-    delU = processed_df1[processed_df1['label'] != 3]
+def build_pu_scenario(processed_df, hide_ratio=0.2, random_seed=42):
+    """
+    构建PU场景：去掉label=3的样本，隐藏一部分正样本放入U集
+    return: X_p, X_u, y_p, y_u, 隐藏的正样本索引
+    """
+    delU = processed_df[processed_df['label'] != 3]
     y = delU['label'].copy()
     X = delU.drop(columns=['label'])
     print(len(y))
 
     positive_indices = y[y == 1].index
-    hidden_positive_indices = np.random.choice(positive_indices, int(len(positive_indices) * 0.2), replace=False)
+    # 固定随机种子，保证重复运行时数据指纹一致，可以从断点继续训练
+    rng = np.random.default_rng(random_seed)
+    hidden_positive_indices = rng.choice(positive_indices, int(len(positive_indices) * hide_ratio), replace=False)
     known_positive_indices = list(set(positive_indices) - set(hidden_positive_indices))
 
     X_p = X.loc[known_positive_indices]
@@ -350,17 +1593,109 @@ if __name__ == "__main__":
     print(f"\nPU场景构建:")
     print(f"已知风险客户(P): {len(X_p)} 个")
     print(f"未标记数据(U): {len(X_u)} 个 (包含 {len(hidden_positive_indices)} 个隐藏风险客户)")
+    return X_p, X_u, y_p, y_u, hidden_positive_indices
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Bagging PU 模型训练与打分')
+    parser.add_argument('--score-only', action='store_true', help='跳过训练，加载模型仓库中已保存的模型直接打分')
+    parser.add_argument('--refresh', action='store_true', help='在模型仓库中已保存的模型上增量刷新，而不是从头训练')
+    parser.add_argument('--refresh-rounds', type=int, default=100, help='增量刷新时每个子模型最多追加的迭代轮数')
+    parser.add_argument('--model-version', default=None, help='--score-only/--refresh 时使用的模型版本，默认最新版本')
+    parser.add_argument('--count-above', type=float, default=None,
+                        help='只统计概率不低于该阈值的样本数（提前退出打分，使用已保存的模型，不写预测文件）；'
+                             '所有样本都按完整集成打分，不使用训练时的袋外概率')
+    parser.add_argument('--count-z', type=float, default=None,
+                        help='与 --count-above 一起使用：提前退出的统计界倍数，默认不使用（只用精确界，结果与predict_proba一致）')
+    parser.add_argument('--distill', action='store_true', help='训练完成后把集成模型蒸馏为单个打分模型，与集成模型同版本保存')
+    parser.add_argument('--prune', type=int, default=None,
+                        help='训练完成后剪枝保留的子模型个数，剪枝模型保存为 <版本号>_pruned<个数> 版本')
+    parser.add_argument('--incremental', action='store_true',
+                        help='与 --score-only 一起使用：特征未变化的行复用同一模型版本上次的概率，只对新增或变化的行打分')
+    parser.add_argument('--native-categorical', action='store_true',
+                        help='分类列保留为category类型，由LightGBM按原生分类特征处理（不使用整数编码）')
+    args = parser.parse_args()
+
+    df = load_typed_csv(r'data/train.csv')
+    print(f"加载数据: {df.shape}")
+    print(f"列名: {list(df.columns)}")
+
+    if args.count_above is not None:
+        # 只需要阈值判定时（如高置信样本计数），大部分样本无需计算全部子模型；
+        # 计数基于完整集成的概率，训练时写出的预测结果中U集样本为袋外概率，两者的计数可能不同
+        pu_model = load_from_store(MODEL_STORE_DIR, args.model_version)
+        processed_df1 = preprocess_for_model(pu_model, df)
+        decisions, _, _ = pu_model.predict_decision(
+            processed_df1.drop('label', axis=1), threshold=args.count_above, z=args.count_z
+        )
+        print(json.dumps({
+            'threshold': args.count_above, 'count': int(decisions.sum()), 'total': len(decisions),
+            'z': args.count_z, 'scoring': 'full_ensemble'
+        }))
+        raise SystemExit(0)
+
+    if args.score_only:
+        # 仅打分：按模型保存时的预处理方案处理数据，不再训练
+        pu_model = load_from_store(MODEL_STORE_DIR, args.model_version)
+        processed_df1 = preprocess_for_model(pu_model, df)
+        all_X = processed_df1.drop('label', axis=1)  # 全量待预测样本
+        if args.incremental:
+            # 特征未变化的客户直接复用同一模型版本上次的打分结果
+            risk_proba = predict_proba_incremental(pu_model, all_X)
+        else:
+            risk_proba = pu_model.predict_proba(all_X)
+    else:
+        if args.refresh:
+            # 增量刷新沿用模型保存时的预处理方案，保证特征编码与已有的树一致
+            pu_model = load_from_store(MODEL_STORE_DIR, args.model_version)
+            preprocess_config = pu_model.preprocess_config
+            preprocess_plan = pu_model.preprocess_plan or PreprocessPlan(**preprocess_config).fit(df)
+        else:
+            preprocess_config = generate_config_from_data(
+                df, n_workers=-1, cache_dir='result/pu_schema_cache', source_key=source_fingerprint(r'data/train.csv')
+            )
+            preprocess_plan = PreprocessPlan(**preprocess_config, native_categorical=args.native_categorical).fit(df)
+        processed_df1 = process_pipeline(df, plan=preprocess_plan)
+        print(f"\n处理后列名: {list(processed_df1.columns)}")
+        print("\n处理后的数据类型:")
+        print(processed_df1.dtypes.value_counts())
+
+        # 构建PU场景
+        X_p, X_u, y_p, y_u, hidden_positive_indices = build_pu_scenario(processed_df1)
 
-    # 训练PU模型
-    pu_model = BaggingPULeaning(n_estimators=200, imbalance_ratio=0.3)
-    pu_model.fit(X_p, X_u, y_p, y_u)
+        # 训练PU模型
+        if args.refresh:
+            pu_model.telemetry_path = TELEMETRY_PATH
+            pu_model.refresh(X_p, X_u, y_p, y_u, n_rounds=args.refresh_rounds)
+        else:
+            pu_model = BaggingPULeaning(n_estimators=200, imbalance_ratio=0.3, n_workers=-1, oob_score=True,
+                                        early_stopping_rounds=50, checkpoint_dir='result/pu_checkpoint',
+                                        adaptive_tol=1e-3, telemetry_path=TELEMETRY_PATH)
+            pu_model.fit(X_p, X_u, y_p, y_u)
+        pu_model.preprocess_config = preprocess_config
+        pu_model.preprocess_plan = preprocess_plan
+        version = save_to_store(pu_model, MODEL_STORE_DIR)
+        if args.distill:
+            distilled = pu_model.distill(processed_df1.drop('label', axis=1))
+            distilled.save(os.path.join(MODEL_STORE_DIR, f'pu_distilled_{version}.pkl'))
+        if args.prune:
+            # 在全量样本的随机子集上评估排序一致性
+            all_X = processed_df1.drop('label', axis=1)
+            X_val = all_X.sample(min(len(all_X), 10000), random_state=42)
+            pruned_model = pu_model.prune(X_val, n_keep=args.prune)
+            save_to_store(pruned_model, MODEL_STORE_DIR, version=f'{version}_pruned{args.prune}', update_latest=False)
 
-    # 全量预测
-    all_X = processed_df1.drop('label', axis=1)  # 全量待预测样本
-    risk_proba = pu_model.predict_proba(all_X)  # 每个样本的违约概率
-    processed_df1['违约风险概率'] = risk_proba
+        # 全量预测：U集样本直接使用训练时累积的袋外概率，只对其余样本（P集、label=3样本）重新打分
+        all_X = processed_df1.drop('label', axis=1)  # 全量待预测样本
+        risk_proba = pd.Series(np.nan, index=all_X.index)
+        oob_proba = pu_model.oob_predict_proba().dropna()
+        risk_proba.loc[oob_proba.index] = oob_proba
+        rest_index = risk_proba.index[risk_proba.isna()]
+        if len(rest_index) > 0:
+            risk_proba.loc[rest_index] = pu_model.predict_proba(all_X.loc[rest_index])  # 每个样本的违约概率
 
-    # 保存预测结果
-    os.makedirs('result/pu_eval_output', exist_ok=True)
-    processed_df1.to_csv('result/pu_eval_output/pu_predictions.csv', index=False)
-    print("预测结果已保存到: result/pu_eval_output/pu_predictions.csv")
+    # 保存预测结果：只写出行号、标签、违约风险概率和模型版本，特征列需要时用 join_predictions 按行号拼接
+    predictions_path = save_predictions(
+        processed_df1.index, processed_df1['label'], risk_proba, pu_model.ensemble_version_
+    )
+    print(f"预测结果已保存到: {predictions_path}")
@@ -0,0 +1,156 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# 按 全部特征.txt 中声明的字段类型读取训练数据：字符串字段读为category，decimal读为float32，
+# int按取值范围压缩为最小整数类型，纯标识列在解析阶段直接丢弃；解析结果缓存为列式文件，CSV不变时直接复用
+
+FEATURE_SCHEMA_FILE = 'data/全部特征.txt'
+DATA_CACHE_DIR = 'result/data_cache'
+
+# 每行/每个客户唯一的编号类字段，对建模没有信息量，只占内存
+ID_COLUMNS = (
+    'party_id', 'customerid', 'customer_id', 'serialno', 'preserialno',
+    'iden_no', 'org_cd_no', 'corp_no', 'reg_id', 'safe_code'
+)
+
+def load_feature_schema(feature_file=FEATURE_SCHEMA_FILE):
+    """读取特征文件，返回 {字段名: SQL类型}（数据类型字段可能含逗号，只在前两个逗号处分割）"""
+    schema = {}
+    with open(feature_file, 'r', encoding='utf-8') as f:
+        next(f)
+        for line in f:
+            parts = line.strip().split(',', 2)
+            if len(parts) < 3:
+                continue
+            schema[parts[0]] = parts[2].strip().lower()
+    return schema
+
+def sql_type_to_dtype(sql_type):
+    """SQL类型 -> 读取时使用的pandas类型；int先读为float32（可能有缺失），读完再压缩"""
+    if sql_type.startswith(('varchar', 'char', 'string')):
+        return 'category'
+    if sql_type.startswith(('decimal', 'numeric', 'double', 'float', 'int', 'bigint', 'smallint')):
+        return 'float32'
+    return None
+
+def read_csv_kwargs(feature_file=FEATURE_SCHEMA_FILE, id_columns=ID_COLUMNS, numeric=True):
+    """
+    按特征文件生成read_csv参数（dtype与usecols）
+    numeric: 是否在读取时直接把数值字段解析为float32；为False时只指定category，数值字段由coerce_numeric_columns转换
+    """
+    schema = load_feature_schema(feature_file)
+    dtype = {}
+    for col, sql_type in schema.items():
+        col_dtype = sql_type_to_dtype(sql_type)
+        if col_dtype == 'category' or (numeric and col_dtype is not None):
+            dtype[col] = col_dtype
+    drop = set(id_columns)
+    return {'dtype': dtype, 'usecols': lambda col: col not in drop}
+
+def coerce_numeric_columns(df, schema):
+    """把声明为数值的字段转换为float32，无法解析的取值置为缺失，返回出现无法解析取值的字段"""
+    coerced = []
+    for col in df.columns:
+        if sql_type_to_dtype(schema.get(col, '')) == 'float32' and df[col].dtype != np.float32:
+            values = pd.to_numeric(df[col], errors='coerce')
+            if values.isna().sum() > df[col].isna().sum():
+                coerced.append(col)
+            df[col] = values.astype(np.float32)
+    return coerced
+
+def _shrink_ints(df, schema):
+    """int字段无缺失时压缩为最小整数类型，label同样处理"""
+    int_columns = [col for col in df.columns if schema.get(col, '').startswith(('int', 'bigint', 'smallint'))]
+    if 'label' in df.columns:
+        int_columns.append('label')
+    for col in int_columns:
+        if not df[col].isna().any():
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+    return df
+
+def _decategorize_unique(df):
+    """几乎每行取值都不同的字符串字段（名称、地址等）做category反而更占内存，转回普通字符串"""
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype) and len(df[col].cat.categories) > len(df) // 2:
+            df[col] = df[col].astype(str).where(df[col].notna())
+    return df
+
+def _read_typed_csv(csv_path, feature_file, id_columns):
+    schema = load_feature_schema(feature_file)
+    try:
+        df = pd.read_csv(csv_path, **read_csv_kwargs(feature_file, id_columns))
+    except ValueError:
+        # 数值字段中存在无法解析的取值：先按文本读入，再把无法解析的取值置为缺失
+        df = pd.read_csv(csv_path, **read_csv_kwargs(feature_file, id_columns, numeric=False))
+        print(f"以下数值字段含无法解析的取值，已置为缺失: {coerce_numeric_columns(df, schema)}")
+    return _decategorize_unique(_shrink_ints(df, schema))
+
+def iter_typed_csv(csv_path, chunksize, feature_file=FEATURE_SCHEMA_FILE, id_columns=ID_COLUMNS):
+    """按特征文件类型分块读取CSV（流式打分用），特征文件不存在时按默认类型分块读取"""
+    if not os.path.exists(feature_file):
+        yield from pd.read_csv(csv_path, chunksize=chunksize)
+        return
+    schema = load_feature_schema(feature_file)
+    for chunk in pd.read_csv(csv_path, chunksize=chunksize, **read_csv_kwargs(feature_file, id_columns, numeric=False)):
+        coerce_numeric_columns(chunk, schema)
+        yield chunk
+
+def _cache_key(csv_path, feature_file, id_columns):
+    """CSV与特征文件的大小和修改时间，任一变化缓存即失效"""
+    stats = [os.stat(path) for path in (csv_path, feature_file)]
+    return hashlib.sha1(json.dumps([
+        os.path.abspath(csv_path), [[s.st_size, s.st_mtime_ns] for s in stats], sorted(id_columns)
+    ]).encode('utf-8')).hexdigest()[:16]
+
+def source_fingerprint(csv_path, feature_file=FEATURE_SCHEMA_FILE, id_columns=ID_COLUMNS):
+    """数据文件的指纹（CSV与特征文件的路径、大小和修改时间），供以读取结果为输入的下游缓存使用"""
+    paths = [path for path in (csv_path, feature_file) if os.path.exists(path)]
+    return hashlib.sha1(json.dumps([
+        [os.path.abspath(path), os.stat(path).st_size, os.stat(path).st_mtime_ns] for path in paths
+    ] + [sorted(id_columns)]).encode('utf-8')).hexdigest()[:16]
+
+def parquet_available():
+    """是否可以读写parquet（需要pyarrow），不可用时缓存与结果文件改用pickle"""
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def load_typed_csv(csv_path, feature_file=FEATURE_SCHEMA_FILE, id_columns=ID_COLUMNS, cache_dir=DATA_CACHE_DIR):
+    """
+    按特征文件声明的类型读取CSV
+    csv_path: 数据文件
+    feature_file: 特征文件（字段名,中文名称,数据类型），不存在时退回普通read_csv
+    id_columns: 读取时丢弃的标识列
+    cache_dir: 列式缓存目录（有pyarrow时为parquet，否则为pickle），None为不缓存
+    """
+    if not os.path.exists(feature_file):
+        print(f"未找到特征文件 {feature_file}，按默认类型读取")
+        return pd.read_csv(csv_path)
+
+    cache_path = None
+    if cache_dir is not None:
+        suffix = 'parquet' if parquet_available() else 'pkl'
+        stem = os.path.splitext(os.path.basename(csv_path))[0]
+        cache_path = os.path.join(cache_dir, f'{stem}_{_cache_key(csv_path, feature_file, id_columns)}.{suffix}')
+        if os.path.exists(cache_path):
+            print(f"使用数据缓存: {cache_path}")
+            return pd.read_parquet(cache_path) if suffix == 'parquet' else pd.read_pickle(cache_path)
+
+    df = _read_typed_csv(csv_path, feature_file, id_columns)
+    print(f"按特征文件类型读取 {csv_path}: {df.shape}，内存 {df.memory_usage(deep=True).sum() / 1024 ** 2:.1f}MB")
+
+    if cache_path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = cache_path + '.tmp'
+        if cache_path.endswith('.parquet'):
+            df.to_parquet(tmp_path, index=False)
+        else:
+            df.to_pickle(tmp_path)
+        os.replace(tmp_path, cache_path)
+    return df
@@ -1,3 +1,4 @@
+import argparse
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
@@ -7,10 +8,23 @@ from xgboost import XGBClassifier
 from sklearn.preprocessing import LabelEncoder
 import os
 
+from data_loader import load_typed_csv
+from pu_predictions import PROBA_COLUMN, load_predictions
+from shared_matrix import SharedMatrix
+from thread_budget import budgeted_process_pool, resolve_threads, split_budget
+
 # 设置中文字体
 plt.rcParams['font.sans-serif'] = ['SimHei']
 plt.rcParams['axes.unicode_minus'] = False
 
+# 类别特征按原生分类类型交给XGBoost，避免在LabelEncoder编码上做无意义的有序切分；
+# 会改变特征排名，默认关闭，运行时用 --native-categorical 开启
+NATIVE_CATEGORICAL = False
+
+# 三个训练集的特征完全相同、只有标签不同：特征矩阵只写入一次共享内存映射文件，三个训练集在进程池中并行做特征选择
+N_WORKERS = -1  # -1为按线程预算自动决定（最多3个进程），1为串行
+SHARED_MATRIX_DIR = 'result/shared_matrix/feature_selection'
+
 # 创建输出目录
 output_dir = 'feature_selection_results'
 os.makedirs(output_dir, exist_ok=True)
@@ -56,26 +70,35 @@ def get_chinese_feature_name(feature_name, feature_map):
 # 1. 读取数据
 def load_data():
     print("读取数据...")
-    train_df = pd.read_csv('train.csv')
-    pu_predictions = pd.read_csv('result/pu_eval_output/pu_predictions.csv')
+    # 按特征文件声明的类型读取（字符串字段为category、数值为float32，标识列已丢弃）
+    train_df = load_typed_csv('train.csv', feature_file='全部特征.txt')
+    # 只读取违约风险概率一列，按行号与训练数据对齐
+    pu_predictions = load_predictions(columns=[PROBA_COLUMN]).reindex(train_df.index)
     return train_df, pu_predictions
 
 # 2. 数据预处理
-def preprocess_data(df):
-    """预处理数据：编码类别特征，填充缺失值"""
+def preprocess_data(df, native_categorical=False, max_native_categories=255):
+    """
+    预处理数据：编码类别特征，填充缺失值
+    native_categorical: 类别特征保留为category类型（缺失单独作为'Missing'类别），不做LabelEncoder编码；
+                        取值数超过max_native_categories的列按原生分类处理代价很高，仍做LabelEncoder编码
+    """
     # 分离特征和标签
     X = df.drop('label', axis=1)
     y = df['label'].astype(int)
     
     # 处理类别特征
-    categorical_cols = X.select_dtypes(include=['object']).columns.tolist()
+    categorical_cols = X.select_dtypes(include=['object', 'category']).columns.tolist()
     for col in categorical_cols:
-        X[col] = X[col].fillna('Missing')
+        X[col] = X[col].astype(object).fillna('Missing')
+        if native_categorical and X[col].nunique() <= max_native_categories:
+            X[col] = X[col].astype(str).astype('category')
+            continue
         le = LabelEncoder()
         X[col] = le.fit_transform(X[col].astype(str))
     
     # 处理数值特征缺失
-    numerical_cols = X.select_dtypes(include=['int64', 'float64']).columns.tolist()
+    numerical_cols = X.select_dtypes(include=['number']).columns.tolist()
     for col in numerical_cols:
         X[col] = X[col].fillna(-999)
     
@@ -129,24 +152,35 @@ def generate_training_sets(train_df, pu_predictions):
     return train1, train2, train3
 
 # 4. 特征选择集成算法
-def ensemble_feature_selection(X, y, feature_names, weights=[0.3, 0.4, 0.3], top_k=50):
-    """集成特征选择算法：MI、XGBoost、RF，权重分别为0.3、0.4、0.3"""
-    
+def ensemble_feature_selection(X, y, feature_names, weights=[0.3, 0.4, 0.3], top_k=50, n_jobs=-1):
+    """
+    集成特征选择算法：MI、XGBoost、RF，权重分别为0.3、0.4、0.3
+    X中的category列由XGBoost按原生分类特征处理；MI与RF不支持分类类型，使用其类别编码（MI按离散特征计算）
+    n_jobs: XGBoost与RF使用的线程数，-1为当前进程的全部线程预算（见thread_budget）
+    """
+    categorical_mask = np.array([isinstance(dtype, pd.CategoricalDtype) for dtype in X.dtypes])
+    X_codes = X
+    if categorical_mask.any():
+        X_codes = X.assign(**{col: X[col].cat.codes for col in X.columns[categorical_mask]})
+
     # MI特征重要性
-    mi_scores = mutual_info_classif(X, y, random_state=42)
+    mi_scores = mutual_info_classif(
+        X_codes, y, discrete_features=categorical_mask if categorical_mask.any() else 'auto', random_state=42
+    )
     mi_ranks = np.argsort(mi_scores)[::-1]  # 降序排序的索引
     mi_rank_dict = {feature_names[i]: len(mi_ranks) - rank for rank, i in enumerate(mi_ranks)}
     
     # XGBoost特征重要性
-    xgb = XGBClassifier(random_state=42, n_jobs=-1)
+    n_jobs = resolve_threads(n_jobs)
+    xgb = XGBClassifier(random_state=42, n_jobs=n_jobs, tree_method='hist', enable_categorical=bool(categorical_mask.any()))
     xgb.fit(X, y)
     xgb_scores = xgb.feature_importances_
     xgb_ranks = np.argsort(xgb_scores)[::-1]
     xgb_rank_dict = {feature_names[i]: len(xgb_ranks) - rank for rank, i in enumerate(xgb_ranks)}
     
     # RF特征重要性
-    rf = RandomForestClassifier(random_state=42, n_jobs=-1)
-    rf.fit(X, y)
+    rf = RandomForestClassifier(random_state=42, n_jobs=n_jobs)
+    rf.fit(X_codes, y)
     rf_scores = rf.feature_importances_
     rf_ranks = np.argsort(rf_scores)[::-1]
     rf_rank_dict = {feature_names[i]: len(rf_ranks) - rank for rank, i in enumerate(rf_ranks)}
@@ -238,8 +272,14 @@ def visualize_feature_comparison(feature_sets, set_names, output_dir, feature_ma
     
     print("\n特征对比可视化完成！")
 
+def _select_in_worker(args):
+    """子进程：挂载共享特征矩阵（只传递路径，不复制数据），用给定标签做特征选择"""
+    matrix, y, n_jobs = args
+    X = matrix.to_frame()
+    return ensemble_feature_selection(X, pd.Series(y, index=X.index), X.columns.tolist(), n_jobs=n_jobs)
+
 # 主函数
-def main():
+def main(native_categorical=NATIVE_CATEGORICAL):
     print("开始执行集成学习特征选择算法...")
     
     # 0. 加载特征映射
@@ -253,14 +293,21 @@ def main():
     training_sets = [train1, train2, train3]
     set_names = ['训练集1_高置信负转正', '训练集2_伪正样本补充', '训练集3_原始数据']
     
-    # 3. 对每个训练集进行特征选择
+    # 3. 对每个训练集进行特征选择（各训练集只有标签不同，特征只预处理一次）
+    X, _ = preprocess_data(training_sets[0], native_categorical=native_categorical)
+    labels = [train['label'].astype(int).to_numpy() for train in training_sets]
+    n_workers, n_jobs = split_budget(N_WORKERS, len(labels))
+    if n_workers > 1:
+        matrix = SharedMatrix.create(X, SHARED_MATRIX_DIR)
+        print(f"\n并行特征选择: {n_workers}个进程, 每个进程{n_jobs}个线程, 共享特征矩阵: {SHARED_MATRIX_DIR}")
+        with budgeted_process_pool(n_workers, n_jobs) as executor:
+            results = list(executor.map(_select_in_worker, [(matrix, y, n_jobs) for y in labels]))
+    else:
+        results = [ensemble_feature_selection(X, pd.Series(y, index=X.index), X.columns.tolist()) for y in labels]
+
     all_top_features = []
-    for i, (train, name) in enumerate(zip(training_sets, set_names)):
+    for name, (top_features, _) in zip(set_names, results):
         print(f"\n=== 处理{name} ===")
-        # 预处理数据
-        X, y = preprocess_data(train)
-        # 执行集成特征选择
-        top_features, _ = ensemble_feature_selection(X, y, X.columns.tolist())
         all_top_features.append(top_features)
         print(f"{name}的Top 50特征：")
         for j, feature in enumerate(top_features[:10]):
@@ -274,4 +321,8 @@ def main():
     print(f"特征选择结果已保存到目录：{output_dir}")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='集成学习特征选择')
+    parser.add_argument('--native-categorical', action='store_true',
+                        help='类别特征按XGBoost原生分类特征处理（取值数不超过255的列），不做LabelEncoder编码')
+    args = parser.parse_args()
+    main(native_categorical=args.native_categorical)
\ No newline at end of file
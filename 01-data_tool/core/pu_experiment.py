@@ -0,0 +1,149 @@
+import argparse
+import itertools
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics import roc_auc_score
+
+from PU_bagging import BaggingPULeaning, PreprocessPlan, build_pu_scenario, generate_config_from_data
+from data_loader import load_typed_csv, source_fingerprint
+from shared_matrix import SharedMatrix
+from thread_budget import budgeted_process_pool, split_budget
+
+# 重复PU实验：每次按不同种子隐藏一部分已知正样本放入U集，训练后看隐藏正样本能被找回多少，
+# 多个配置 × 多个种子在进程池中并行运行，按配置汇总均值与标准差
+
+EXPERIMENT_DIR = 'result/pu_experiments'
+
+# 子进程内缓存的预处理数据，由 _init_experiment_worker 挂载共享矩阵后构造一次
+_worker_data = {}
+
+def hidden_positive_metrics(scores, is_hidden, ks=(50, 100, 200)):
+    """
+    隐藏正样本的找回指标
+    scores: U集每个样本的得分
+    is_hidden: U集每个样本是否为隐藏的正样本
+    ks: recall@k 的k列表
+    return: {'auc': 隐藏正样本相对其余U样本的AUC, 'recall@k': 得分前k名中找回的隐藏正样本比例, ...}
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    is_hidden = np.asarray(is_hidden, dtype=bool)
+    n_hidden = int(is_hidden.sum())
+    metrics = {'n_hidden': n_hidden}
+    metrics['auc'] = roc_auc_score(is_hidden, scores) if 0 < n_hidden < len(scores) else np.nan
+
+    # 按得分降序累计命中数，一次取出所有k处的值
+    hits = np.cumsum(is_hidden[np.argsort(-scores, kind='stable')])
+    recalls = hits[np.minimum(np.asarray(ks), len(scores)) - 1] / max(n_hidden, 1)
+    for k, recall in zip(ks, recalls):
+        metrics[f'recall@{k}'] = recall
+    return metrics
+
+def run_repetition(processed_df, model_params, seed, hide_ratio=0.2, ks=(50, 100, 200)):
+    """
+    单次隐藏-找回实验：按seed隐藏正样本、训练并在U集上评估
+    U集得分使用袋外概率（隐藏正样本在袋内时被当作负样本训练，袋内得分偏低），无袋外概率的样本用完整集成补齐
+    """
+    X_p, X_u, y_p, y_u, hidden = build_pu_scenario(processed_df, hide_ratio=hide_ratio, random_seed=seed)
+    model = BaggingPULeaning(**dict(model_params, random_seed=seed, oob_score=True))
+    t0 = time.time()
+    model.fit(X_p, X_u, y_p, y_u)
+    fit_time = time.time() - t0
+
+    scores = model.oob_predict_proba().reindex(X_u.index)
+    missing = scores.isna().to_numpy()
+    if missing.any():
+        scores[missing] = model.predict_proba(X_u[missing])
+    metrics = hidden_positive_metrics(scores.to_numpy(), X_u.index.isin(hidden), ks)
+    metrics.update(seed=seed, fit_time=fit_time, n_models=len(model.models))
+    return metrics
+
+def _init_experiment_worker(matrix):
+    # 挂载共享矩阵（只传递路径），还原带label列的预处理数据
+    processed_df = matrix.to_frame()
+    processed_df['label'] = np.asarray(matrix.labels)
+    _worker_data['processed_df'] = processed_df
+
+def _run_in_worker(task):
+    config_name, model_params, seed, hide_ratio, ks = task
+    metrics = run_repetition(_worker_data['processed_df'], model_params, seed, hide_ratio, ks)
+    metrics['config'] = config_name
+    return metrics
+
+def run_experiments(processed_df, configs, n_repeats=5, hide_ratio=0.2, ks=(50, 100, 200), n_workers=1,
+                    base_seed=0, shared_matrix_dir=os.path.join(EXPERIMENT_DIR, 'shared_matrix')):
+    """
+    并行运行 配置数 × n_repeats 次实验
+    processed_df: 预处理后的数据（含label列）
+    configs: {配置名: BaggingPULeaning构造参数}
+    n_workers: 并行进程数，-1为线程预算内的全部核，1为串行；并行时每个实验内部串行训练，线程预算在进程间均分
+    return: (每次实验的明细DataFrame, 按配置汇总的DataFrame)
+    """
+    seeds = [base_seed + r for r in range(n_repeats)]
+    tasks = [(name, params, seed, hide_ratio, tuple(ks)) for name, params in configs.items() for seed in seeds]
+    print(f"共 {len(tasks)} 次实验: {len(configs)} 个配置 × {n_repeats} 次重复")
+
+    n_workers, n_threads = split_budget(n_workers, len(tasks))
+    rows = []
+    if n_workers <= 1:
+        for name, params, seed, _, _ in tasks:
+            metrics = run_repetition(processed_df, params, seed, hide_ratio, ks)
+            metrics['config'] = name
+            rows.append(metrics)
+    else:
+        tasks = [(name, dict(params, n_workers=1, n_threads=n_threads), seed, hr, k)
+                 for name, params, seed, hr, k in tasks]
+        # 预处理数据只写入一次共享矩阵，各子进程挂载
+        matrix = SharedMatrix.create(processed_df.drop(columns=['label']), shared_matrix_dir, processed_df['label'])
+        with budgeted_process_pool(n_workers, n_threads, initializer=_init_experiment_worker,
+                                   initargs=(matrix,)) as executor:
+            for metrics in executor.map(_run_in_worker, tasks):
+                rows.append(metrics)
+                print(f"完成实验 {len(rows)}/{len(tasks)}: {metrics['config']} seed={metrics['seed']} "
+                      f"AUC={metrics['auc']:.4f}")
+
+    details = pd.DataFrame(rows)
+    metric_cols = ['auc'] + [f'recall@{k}' for k in ks] + ['fit_time', 'n_models']
+    summary = details.groupby('config', sort=False)[metric_cols].agg(['mean', 'std'])
+    summary.columns = [f'{metric}_{stat}' for metric, stat in summary.columns]
+    return details, summary.reset_index()
+
+def grid_configs(base_params, imbalance_ratios, n_estimators_list):
+    """imbalance_ratio × n_estimators 网格，配置名形如 ir0.3_n100"""
+    return {
+        f'ir{ratio}_n{n}': dict(base_params, imbalance_ratio=ratio, n_estimators=n)
+        for ratio, n in itertools.product(imbalance_ratios, n_estimators_list)
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='重复PU隐藏-找回实验，比较不同imbalance_ratio与n_estimators配置')
+    parser.add_argument('--input', default='data/train.csv', help='训练数据CSV路径')
+    parser.add_argument('--repeats', type=int, default=5, help='每个配置的重复次数（种子依次为0,1,...）')
+    parser.add_argument('--imbalance-ratios', type=float, nargs='+', default=[0.2, 0.3], help='待比较的imbalance_ratio')
+    parser.add_argument('--n-estimators', type=int, nargs='+', default=[50, 100], help='待比较的子模型个数')
+    parser.add_argument('--hide-ratio', type=float, default=0.2, help='每次隐藏的已知正样本比例')
+    parser.add_argument('--ks', type=int, nargs='+', default=[50, 100, 200], help='recall@k 的k')
+    parser.add_argument('--workers', type=int, default=-1, help='并行进程数，-1为线程预算内的全部核，1为串行')
+    parser.add_argument('--native-categorical', action='store_true', help='分类列按LightGBM原生分类特征处理')
+    args = parser.parse_args()
+
+    df = load_typed_csv(args.input)
+    config = generate_config_from_data(
+        df, n_workers=-1, cache_dir='result/pu_schema_cache', source_key=source_fingerprint(args.input)
+    )
+    processed_df = PreprocessPlan(**config, native_categorical=args.native_categorical).fit_transform(df)
+
+    base_params = {'num_boost_round': 1200, 'early_stopping_rounds': 50}
+    configs = grid_configs(base_params, args.imbalance_ratios, args.n_estimators)
+    details, summary = run_experiments(
+        processed_df, configs, n_repeats=args.repeats, hide_ratio=args.hide_ratio, ks=args.ks, n_workers=args.workers
+    )
+
+    os.makedirs(EXPERIMENT_DIR, exist_ok=True)
+    details.to_csv(os.path.join(EXPERIMENT_DIR, 'experiment_details.csv'), index=False)
+    summary.to_csv(os.path.join(EXPERIMENT_DIR, 'experiment_summary.csv'), index=False)
+    print("\n实验汇总:")
+    print(summary.to_string(index=False))
+    print(f"实验结果已保存到: {EXPERIMENT_DIR}")
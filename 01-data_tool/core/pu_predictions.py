@@ -0,0 +1,88 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from data_loader import parquet_available
+
+# 紧凑的PU预测结果：每行只保存行号、标签、违约风险概率和模型版本（列式文件），
+# 不再把预处理后的全部特征列随概率一起写出；需要查看特征时按行号与原始数据按需拼接
+
+PREDICTIONS_DIR = 'result/pu_eval_output'
+PREDICTIONS_STEM = 'pu_scores'
+# 旧版本PU_bagging.py写出的预测结果（完整处理后数据 + 违约风险概率的CSV）
+LEGACY_PREDICTIONS_FILE = 'pu_predictions.csv'
+PROBA_COLUMN = '违约风险概率'
+
+def save_predictions(row_ids, labels, proba, ensemble_version, output_dir=PREDICTIONS_DIR):
+    """
+    保存紧凑的预测结果
+    row_ids: 行号（数据文件中的行序号，即读入后的行索引）
+    labels: 标签
+    proba: 违约风险概率
+    ensemble_version: 打分所用的模型版本，未保存到模型仓库的模型为None
+    return: 结果文件路径（有pyarrow时为parquet，否则为pickle）
+    """
+    predictions = pd.DataFrame({
+        'row_id': np.asarray(row_ids, dtype=np.int64),
+        'label': pd.to_numeric(np.asarray(labels), downcast='integer'),
+        PROBA_COLUMN: np.asarray(proba, dtype=np.float32),
+    })
+    # 版本号在所有行上相同，按category保存只占一份字典
+    predictions['ensemble_version'] = pd.Categorical([ensemble_version] * len(predictions))
+
+    os.makedirs(output_dir, exist_ok=True)
+    suffix = 'parquet' if parquet_available() else 'pkl'
+    path = os.path.join(output_dir, f'{PREDICTIONS_STEM}.{suffix}')
+    tmp_path = path + '.tmp'
+    if suffix == 'parquet':
+        predictions.to_parquet(tmp_path, index=False)
+    else:
+        predictions.to_pickle(tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+def find_predictions(output_dir=PREDICTIONS_DIR):
+    """返回最新的预测结果文件路径（紧凑文件与旧版本写出的CSV同时存在时取修改时间较新的一个），都不存在时返回None"""
+    candidates = [
+        os.path.join(output_dir, name)
+        for name in (f'{PREDICTIONS_STEM}.parquet', f'{PREDICTIONS_STEM}.pkl', LEGACY_PREDICTIONS_FILE)
+    ]
+    candidates = [path for path in candidates if os.path.exists(path)]
+    return max(candidates, key=os.path.getmtime) if candidates else None
+
+def load_predictions(output_dir=PREDICTIONS_DIR, columns=None):
+    """
+    读取预测结果，返回以row_id为索引的DataFrame
+    columns: 需要的列（label、违约风险概率、ensemble_version），None为全部；列式文件只读取这些列
+    违约风险概率以float32保存，读取后转为float64，与旧格式CSV读取结果一致（下游统计值可直接JSON序列化）
+    """
+    path = find_predictions(output_dir)
+    if path is None:
+        raise FileNotFoundError(f'{output_dir} 下未找到预测结果文件')
+    if path.endswith('.csv'):
+        # 旧格式CSV没有row_id，行号即文件中的行序号；只解析需要的列
+        wanted = ['label', PROBA_COLUMN] if columns is None else list(columns)
+        predictions = pd.read_csv(path, usecols=lambda col: col in wanted)
+        predictions.index.name = 'row_id'
+        return predictions
+
+    if path.endswith('.parquet'):
+        predictions = pd.read_parquet(path, columns=None if columns is None else ['row_id', *columns])
+        predictions = predictions.set_index('row_id')
+    else:
+        predictions = pd.read_pickle(path).set_index('row_id')
+        predictions = predictions if columns is None else predictions[list(columns)]
+    if PROBA_COLUMN in predictions.columns:
+        predictions[PROBA_COLUMN] = predictions[PROBA_COLUMN].astype(np.float64)
+    return predictions
+
+def join_predictions(df, predictions=None, output_dir=PREDICTIONS_DIR, columns=(PROBA_COLUMN,)):
+    """
+    按行号把预测结果拼接到数据上（df的行索引为数据文件中的行序号，如load_typed_csv或read_csv读入的数据）
+    predictions: 已读取的预测结果，None时从output_dir读取
+    columns: 拼接的预测列
+    """
+    if predictions is None:
+        predictions = load_predictions(output_dir, columns=columns)
+    return df.join(predictions[list(columns)], how='left')
@@ -0,0 +1,120 @@
+import argparse
+import os
+import time
+from collections import deque
+
+import pandas as pd
+
+from PU_bagging import (
+    BaggingPULeaning, DistilledPUModel, MODEL_STORE_DIR, load_from_store, preprocess_for_model
+)
+from data_loader import FEATURE_SCHEMA_FILE, iter_typed_csv
+from pu_predictions import PROBA_COLUMN
+from thread_budget import budgeted_process_pool, split_budget
+
+# 流式打分：按行块读取超大CSV，用已保存的预处理方案和模型逐块打分并追加写出，内存占用与文件大小无关
+
+# 子进程内缓存的模型，由 _init_score_worker 在进程启动时加载一次
+_worker_model = {}
+
+def load_scoring_model(model_path=None, store_dir=MODEL_STORE_DIR, version=None, distilled=False):
+    """加载打分模型：指定文件路径时直接加载，否则从模型仓库加载指定版本（默认最新）"""
+    if model_path:
+        model_cls = DistilledPUModel if distilled else BaggingPULeaning
+        return model_cls.load(model_path)
+    if distilled:
+        if version is None:
+            raise ValueError("加载蒸馏模型时需指定 --model-path 或 --model-version")
+        return DistilledPUModel.load(os.path.join(store_dir, f'pu_distilled_{version}.pkl'))
+    return load_from_store(store_dir, version)
+
+def score_chunk(model, chunk, start_row, n_threads=-1):
+    """
+    对一个行块做预处理并打分
+    return: 只包含行号、标签（如有）和违约风险概率的DataFrame
+    """
+    # 使用训练时拟合的预处理方案，保证各行块之间以及与训练时的分类编码一致
+    processed = preprocess_for_model(model, chunk)
+    result = pd.DataFrame({'row_id': range(start_row, start_row + len(chunk))})
+    if 'label' in chunk.columns:
+        result['label'] = chunk['label'].to_numpy()
+    result[PROBA_COLUMN] = model.predict_proba(processed, n_threads=n_threads)
+    return result
+
+def _init_score_worker(model_kwargs, n_threads):
+    _worker_model['model'] = load_scoring_model(**model_kwargs)
+    _worker_model['n_threads'] = n_threads
+
+def _score_chunk_in_worker(args):
+    chunk, start_row = args
+    return score_chunk(_worker_model['model'], chunk, start_row, _worker_model['n_threads'])
+
+def _write_result(result, output_path, first):
+    result.to_csv(output_path, mode='w' if first else 'a', header=first, index=False, encoding='utf-8')
+
+def stream_score(input_path, output_path, chunksize=100000, n_workers=1, model_kwargs=None,
+                 feature_file=FEATURE_SCHEMA_FILE):
+    """
+    流式打分主流程
+    input_path: 待打分CSV
+    output_path: 结果CSV（按块追加写出）
+    chunksize: 每块行数
+    n_workers: 并行打分的进程数，1为在当前进程打分
+    model_kwargs: 传给 load_scoring_model 的参数
+    feature_file: 特征文件，存在时按与训练相同的字段类型读取
+    """
+    model_kwargs = model_kwargs or {}
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    reader = iter_typed_csv(input_path, chunksize, feature_file)
+    n_rows = 0
+    t0 = time.time()
+
+    # 线程预算在进程间均分，进程数不超过预算
+    n_workers, n_threads = split_budget(n_workers) if n_workers > 1 else (1, -1)
+    if n_workers <= 1:
+        model = load_scoring_model(**model_kwargs)
+        for chunk in reader:
+            _write_result(score_chunk(model, chunk, n_rows), output_path, n_rows == 0)
+            n_rows += len(chunk)
+            print(f"已打分 {n_rows} 行，用时 {time.time() - t0:.1f}s")
+        return n_rows
+
+    # 同时在途的行块数有上限，避免读入速度快于打分时占满内存
+    pending = deque()
+    first = True
+    with budgeted_process_pool(
+        n_workers, n_threads, initializer=_init_score_worker, initargs=(model_kwargs, n_threads)
+    ) as executor:
+        for chunk in reader:
+            pending.append(executor.submit(_score_chunk_in_worker, (chunk, n_rows)))
+            n_rows += len(chunk)
+            if len(pending) >= 2 * n_workers:
+                _write_result(pending.popleft().result(), output_path, first)
+                first = False
+                print(f"已读取 {n_rows} 行，用时 {time.time() - t0:.1f}s")
+        # 按提交顺序写出剩余结果，保证行序与输入一致
+        while pending:
+            _write_result(pending.popleft().result(), output_path, first)
+            first = False
+    return n_rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='PU模型流式分块打分（适用于无法一次读入内存的CSV）')
+    parser.add_argument('--input', default='data/train.csv', help='待打分CSV路径')
+    parser.add_argument('--output', default='result/pu_eval_output/pu_stream_predictions.csv', help='结果CSV路径')
+    parser.add_argument('--chunksize', type=int, default=100000, help='每块读取的行数')
+    parser.add_argument('--workers', type=int, default=1, help='并行打分的进程数')
+    parser.add_argument('--model-path', default=None, help='模型文件路径，不指定时从模型仓库加载')
+    parser.add_argument('--model-store', default=MODEL_STORE_DIR, help='模型仓库目录')
+    parser.add_argument('--model-version', default=None, help='模型版本，默认最新版本')
+    parser.add_argument('--distilled', action='store_true', help='使用蒸馏后的单模型打分')
+    args = parser.parse_args()
+
+    total = stream_score(
+        args.input, args.output, chunksize=args.chunksize, n_workers=args.workers,
+        model_kwargs={
+            'model_path': args.model_path, 'store_dir': args.model_store,
+            'version': args.model_version, 'distilled': args.distilled
+        }
+    )
+    print(f"打分完成，共 {total} 行，结果已保存到: {args.output}")
@@ -0,0 +1,99 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# 多进程共享的特征矩阵：预处理后的特征只写入磁盘一次（float32，.npy格式的内存映射文件），
+# 标签与行索引单独保存；子进程按路径以只读内存映射方式挂载，不再逐个进程序列化整个DataFrame
+
+FEATURES_FILE = 'features.npy'
+LABELS_FILE = 'labels.npy'
+INDEX_FILE = 'index.npy'
+META_FILE = 'meta.json'
+
+class SharedMatrix:
+    """
+    只读共享的float32特征矩阵
+    features: (n_rows, n_features) 内存映射数组；category列保存为类别编码（缺失为NaN）
+    labels: 标签数组，创建时未提供则为None
+    index: 原DataFrame的行索引
+    columns: 特征列名
+    categories: category列 -> 类别列表，to_frame时据此还原category类型
+    序列化时只传递目录路径，子进程反序列化时重新挂载内存映射，不复制数据
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META_FILE), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.columns = meta['columns']
+        self.categories = meta['categories']
+        self.features = np.load(os.path.join(path, FEATURES_FILE), mmap_mode='r')
+        labels_path = os.path.join(path, LABELS_FILE)
+        self.labels = np.load(labels_path, mmap_mode='r') if os.path.exists(labels_path) else None
+        self.index = pd.Index(np.load(os.path.join(path, INDEX_FILE), allow_pickle=True))
+
+    @classmethod
+    def create(cls, X, path, y=None, chunk_size=100000):
+        """
+        把DataFrame按块写入内存映射文件，并保存标签、行索引与列信息
+        X: 预处理后的特征（数值列与category列）
+        path: 输出目录，已有文件会被覆盖
+        y: 标签（可选）
+        """
+        os.makedirs(path, exist_ok=True)
+        categorical = [col for col, dtype in X.dtypes.items() if isinstance(dtype, pd.CategoricalDtype)]
+        features = np.lib.format.open_memmap(
+            os.path.join(path, FEATURES_FILE), mode='w+', dtype=np.float32, shape=(len(X), X.shape[1])
+        )
+        for start in range(0, len(X), chunk_size):
+            chunk = X.iloc[start:start + chunk_size]
+            if categorical:
+                codes = {col: chunk[col].cat.codes.astype(np.float32).where(chunk[col].notna()) for col in categorical}
+                chunk = chunk.assign(**codes)
+            features[start:start + chunk_size] = chunk.to_numpy(dtype=np.float32, na_value=np.nan)
+        features.flush()
+        del features
+
+        labels_path = os.path.join(path, LABELS_FILE)
+        if y is not None:
+            np.save(labels_path, np.asarray(y))
+        elif os.path.exists(labels_path):
+            os.remove(labels_path)
+        np.save(os.path.join(path, INDEX_FILE), X.index.to_numpy())
+        meta = {
+            'columns': [str(col) for col in X.columns],
+            'categories': {str(col): X[col].cat.categories.tolist() for col in categorical}
+        }
+        with open(os.path.join(path, META_FILE), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        return cls(path)
+
+    @property
+    def shape(self):
+        return self.features.shape
+
+    @property
+    def categorical_columns(self):
+        return list(self.categories)
+
+    def to_frame(self, rows=None):
+        """
+        以DataFrame形式取出（全部或指定行号的）特征；数值列直接引用内存映射数据，category列按类别列表还原
+        rows: 行号数组，None为全部行
+        """
+        values = self.features if rows is None else self.features[rows]
+        index = self.index if rows is None else self.index[rows]
+        df = pd.DataFrame(values, index=index, columns=self.columns, copy=False)
+        if self.categories:
+            df = df.assign(**{
+                col: pd.Categorical.from_codes(np.nan_to_num(df[col].to_numpy(), nan=-1).astype(np.int64), categories)
+                for col, categories in self.categories.items()
+            })
+        return df
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
@@ -0,0 +1,59 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# 嵌套并行的线程预算：外层（进程池、GridSearchCV）与内层（LightGBM/XGBoost/RF的线程）共用一份核数，
+# 外层进程数 × 每个进程的线程数 不超过预算。外层开启子进程时把各自分得的线程数写入环境变量，
+# 子进程内再调用本模块时按这份预算继续划分，不会再按整机核数开线程
+
+# 当前进程可用的线程数；未设置时为本进程可用的CPU核数，可在启动前手工设置以限制整个数据工具的线程数
+BUDGET_ENV = 'DATA_TOOL_THREADS'
+
+def available_threads():
+    """当前进程的线程预算"""
+    value = os.environ.get(BUDGET_ENV)
+    if value:
+        return max(1, int(value))
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def resolve_threads(n_threads=-1):
+    """把 n_threads（-1或None为使用全部预算）解析为具体线程数"""
+    if n_threads is None or n_threads <= 0:
+        return available_threads()
+    return n_threads
+
+def split_budget(n_workers=-1, n_tasks=None):
+    """
+    在外层并行与内层线程之间划分预算
+    n_workers: 外层并行数，-1或None为预算内的全部核；指定的并行数同样不超过预算
+    n_tasks: 外层任务数（如子模型个数），外层并行数不超过任务数
+    return: (外层并行数, 每个外层任务分得的线程数)
+    """
+    budget = available_threads()
+    n_workers = budget if n_workers is None or n_workers <= 0 else min(n_workers, budget)
+    if n_tasks is not None:
+        n_workers = min(n_workers, n_tasks)
+    n_workers = max(1, n_workers)
+    return n_workers, max(1, budget // n_workers)
+
+def set_thread_budget(n_threads):
+    """设置当前进程的线程预算，并限制BLAS/OpenMP线程池（有threadpoolctl时）"""
+    os.environ[BUDGET_ENV] = str(n_threads)
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(n_threads)
+    except ImportError:
+        pass
+
+def _init_budgeted_worker(n_threads, initializer, initargs):
+    set_thread_budget(n_threads)
+    if initializer is not None:
+        initializer(*initargs)
+
+def budgeted_process_pool(n_workers, n_threads, initializer=None, initargs=()):
+    """进程池：每个子进程启动时先设置各自的线程预算，再执行原有的initializer"""
+    return ProcessPoolExecutor(
+        max_workers=n_workers, initializer=_init_budgeted_worker, initargs=(n_threads, initializer, initargs)
+    )
@@ -1,10 +1,18 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, render_template, request, jsonify, send_file, send_from_directory
 import pandas as pd
 import numpy as np
+import io
 import subprocess
 import os
 import sys
 import time
+import json
+
+# core目录下的模块（预测结果的读写），只依赖pandas，不加载建模相关的库
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'core'))
+from pu_predictions import (
+    LEGACY_PREDICTIONS_FILE, PREDICTIONS_DIR, PROBA_COLUMN, find_predictions, join_predictions, load_predictions
+)
 
 # 创建Flask应用
 app = Flask(__name__)
@@ -64,22 +72,32 @@ def upload_file():
 @app.route('/run_model', methods=['POST'])
 def run_model():
     try:
-        # 运行PU_bagging.py脚本
-        result = subprocess.run([
-            "venv/Scripts/python.exe",
-            "core/PU_bagging.py"
-        ], capture_output=True, text=True, cwd="d:/code/P1")
+        # 运行PU_bagging.py脚本，score_only=true 时加载已保存的模型直接打分，跳过训练（incremental=true 时只对变化的行打分）；
+        # refresh=true 时在已保存的模型上增量刷新
+        command = ["venv/Scripts/python.exe", "core/PU_bagging.py"]
+        options = request.get_json(silent=True) or {}
+        if options.get('score_only'):
+            command.append('--score-only')
+            # incremental=true 时只对特征有变化的行重新打分
+            if options.get('incremental'):
+                command.append('--incremental')
+        elif options.get('refresh'):
+            command.append('--refresh')
+            if options.get('refresh_rounds'):
+                command.extend(['--refresh-rounds', str(int(options['refresh_rounds']))])
+        if options.get('model_version'):
+            command.extend(['--model-version', str(options['model_version'])])
+        result = subprocess.run(command, capture_output=True, text=True, cwd="d:/code/P1")
         
         if result.returncode == 0:
-            # 读取预测结果
-            predictions_path = "result/pu_eval_output/pu_predictions.csv"
-            if os.path.exists(predictions_path):
-                df = pd.read_csv(predictions_path)
+            # 读取预测结果（只读取标签和违约风险概率两列）
+            if find_predictions() is not None:
+                df = load_predictions(columns=['label', PROBA_COLUMN])
                 
                 # 计算结果统计
                 top_10 = df.nlargest(10, '违约风险概率')[['违约风险概率']]
                 positive_samples = df[df['label'] == 1]
-                min_positive_confidence = positive_samples['违约风险概率'].min() if not positive_samples.empty else 0
+                min_positive_confidence = float(positive_samples['违约风险概率'].min()) if not positive_samples.empty else 0
                 high_confidence_count = len(df[df['违约风险概率'] >= 0.9])
                 total_samples = len(df)
                 
@@ -115,20 +133,108 @@ def run_model():
             'error': str(e)
         })
 
+# 高置信样本计数接口：使用已保存的模型做提前退出的阈值判定，不重新训练也不写预测文件
+# 所有样本按完整集成打分（不是训练时的袋外概率），因此与 /run_model 基于训练输出的计数可能不同；
+# 参数 threshold（默认0.9）、z（提前退出的统计界倍数，默认不使用，结果与完整打分完全一致）、model_version
+@app.route('/high_confidence_count', methods=['POST'])
+def high_confidence_count():
+    try:
+        options = request.get_json(silent=True) or {}
+        command = [
+            "venv/Scripts/python.exe", "core/PU_bagging.py",
+            "--count-above", str(float(options.get('threshold', 0.9)))
+        ]
+        if options.get('z') is not None:
+            command.extend(['--count-z', str(float(options['z']))])
+        if options.get('model_version'):
+            command.extend(['--model-version', str(options['model_version'])])
+        result = subprocess.run(command, capture_output=True, text=True, cwd="d:/code/P1")
+        if result.returncode == 0:
+            # 脚本最后一行输出为JSON格式的计数结果
+            counts = json.loads(result.stdout.strip().splitlines()[-1])
+            return jsonify({
+                'success': True,
+                'log': result.stdout,
+                'high_confidence_count': counts['count'],
+                'total_samples': counts['total'],
+                'threshold': counts['threshold'],
+                'z': counts['z'],
+                'scoring': counts['scoring']
+            })
+        return jsonify({
+            'success': False,
+            'error': '高置信样本计数失败',
+            'log': result.stdout,
+            'stderr': result.stderr
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        })
+
+# PU子模型训练记录查询接口：按运行查询每个子模型的样本数、分箱/训练耗时、树的数量、峰值内存与验证指标
+# 参数 run_id（默认最近一次运行）、limit（返回的明细条数上限，默认200）
+@app.route('/pu_telemetry')
+def pu_telemetry():
+    telemetry_path = "result/pu_telemetry/pu_bags.jsonl"
+    if not os.path.exists(telemetry_path):
+        return jsonify({'error': '训练记录文件未找到'}), 404
+    try:
+        df = pd.read_json(telemetry_path, lines=True, dtype={'run_id': str}, convert_dates=False)
+        if df.empty:
+            return jsonify({'error': '训练记录为空'}), 404
+        run_ids = df['run_id'].drop_duplicates().tolist()
+        run_id = request.args.get('run_id') or run_ids[-1]
+        run = df[df['run_id'] == run_id]
+        if run.empty:
+            return jsonify({'error': f'未找到运行 {run_id} 的训练记录', 'run_ids': run_ids}), 404
+
+        summary = {
+            'run_id': run_id,
+            'mode': run['mode'].iloc[0],
+            'n_bags': len(run),
+            'total_train_time': float(run['train_time'].sum()),
+            'mean_train_time': float(run['train_time'].mean()),
+            'max_train_time': float(run['train_time'].max()),
+            # 每个进程只分箱一次，按进程去重后求和
+            'total_bin_time': float(run.drop_duplicates('pid')['bin_time'].sum()),
+            'mean_trees': float(run['n_trees'].mean()),
+            'max_peak_rss_mb': float(run['peak_rss_mb'].max()) if run['peak_rss_mb'].notna().any() else None,
+            'mean_valid_metric': float(run['valid_metric'].mean()) if run['valid_metric'].notna().any() else None
+        }
+        limit = int(request.args.get('limit', 200))
+        records = run.head(limit).astype(object).where(run.head(limit).notna(), None).to_dict('records')
+        return jsonify({'success': True, 'run_ids': run_ids, 'summary': summary, 'records': records})
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        })
+
 # 下载预测结果接口
 @app.route('/download_predictions')
 def download_predictions():
-    predictions_path = "result/pu_eval_output"
-    return send_from_directory(predictions_path, "pu_predictions.csv", as_attachment=True)
+    # 下载时才由紧凑的预测结果导出CSV（行号、标签、违约风险概率、模型版本）
+    predictions_path = find_predictions()
+    if predictions_path is None:
+        return jsonify({'error': '预测结果文件未找到'}), 404
+    if predictions_path.endswith('.csv'):
+        return send_from_directory(PREDICTIONS_DIR, LEGACY_PREDICTIONS_FILE, as_attachment=True)
+    csv_bytes = load_predictions().reset_index().to_csv(index=False).encode('utf-8')
+    return send_file(io.BytesIO(csv_bytes), mimetype='text/csv', as_attachment=True,
+                     download_name=LEGACY_PREDICTIONS_FILE)
 
 # 获取完整预测结果接口
 @app.route('/get_full_results')
 def get_full_results():
-    predictions_path = "result/pu_eval_output/pu_predictions.csv"
-    if os.path.exists(predictions_path):
-        df = pd.read_csv(predictions_path)
-        # 只返回前100行数据，避免数据量过大
-        df_sample = df.head(100)
+    if find_predictions() is not None:
+        # 只返回前100行数据，避免数据量过大；特征取自原始数据的前100行，按行号拼接违约风险概率
+        data_path = os.path.join(UPLOAD_FOLDER, 'train.csv')
+        if os.path.exists(data_path):
+            df_sample = join_predictions(pd.read_csv(data_path, nrows=100))
+        else:
+            df_sample = load_predictions().head(100).reset_index()
         # 将NaN值转换为null，以便JSON正确解析
         df_sample = df_sample.fillna(value=np.nan)
         # 转换为字典并处理NaN值
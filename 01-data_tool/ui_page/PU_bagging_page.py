@@ -1,11 +1,18 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, render_template, request, jsonify, send_file, send_from_directory
 import pandas as pd
 import numpy as np
+import io
 import subprocess
 import os
 import sys
 import time
 
+# core目录下的模块（预测结果的读写），只依赖pandas，不加载建模相关的库
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'core'))
+from pu_predictions import (
+    LEGACY_PREDICTIONS_FILE, PREDICTIONS_DIR, PROBA_COLUMN, find_predictions, join_predictions, load_predictions
+)
+
 app = Flask(__name__)
 
 # 设置上传文件夹
@@ -57,15 +64,14 @@ def run_model():
         ], capture_output=True, text=True, cwd="d:/code/P1")
         
         if result.returncode == 0:
-            # 读取预测结果
-            predictions_path = "result/pu_eval_output/pu_predictions.csv"
-            if os.path.exists(predictions_path):
-                df = pd.read_csv(predictions_path)
+            # 读取预测结果（只读取标签和违约风险概率两列）
+            if find_predictions() is not None:
+                df = load_predictions(columns=['label', PROBA_COLUMN])
                 
                 # 计算结果统计
                 top_10 = df.nlargest(10, '违约风险概率')[['违约风险概率']]
                 positive_samples = df[df['label'] == 1]
-                min_positive_confidence = positive_samples['违约风险概率'].min() if not positive_samples.empty else 0
+                min_positive_confidence = float(positive_samples['违约风险概率'].min()) if not positive_samples.empty else 0
                 high_confidence_count = len(df[df['违约风险概率'] >= 0.9])
                 total_samples = len(df)
                 
@@ -104,17 +110,26 @@ def run_model():
 # 下载预测结果接口
 @app.route('/download_predictions')
 def download_predictions():
-    predictions_path = "result/pu_eval_output"
-    return send_from_directory(predictions_path, "pu_predictions.csv", as_attachment=True)
+    # 下载时才由紧凑的预测结果导出CSV（行号、标签、违约风险概率、模型版本）
+    predictions_path = find_predictions()
+    if predictions_path is None:
+        return jsonify({'error': '预测结果文件未找到'}), 404
+    if predictions_path.endswith('.csv'):
+        return send_from_directory(PREDICTIONS_DIR, LEGACY_PREDICTIONS_FILE, as_attachment=True)
+    csv_bytes = load_predictions().reset_index().to_csv(index=False).encode('utf-8')
+    return send_file(io.BytesIO(csv_bytes), mimetype='text/csv', as_attachment=True,
+                     download_name=LEGACY_PREDICTIONS_FILE)
 
 # 获取完整预测结果接口
 @app.route('/get_full_results')
 def get_full_results():
-    predictions_path = "result/pu_eval_output/pu_predictions.csv"
-    if os.path.exists(predictions_path):
-        df = pd.read_csv(predictions_path)
-        # 只返回前100行数据，避免数据量过大
-        df_sample = df.head(100)
+    if find_predictions() is not None:
+        # 只返回前100行数据，避免数据量过大；特征取自原始数据的前100行，按行号拼接违约风险概率
+        data_path = os.path.join(UPLOAD_FOLDER, 'train.csv')
+        if os.path.exists(data_path):
+            df_sample = join_predictions(pd.read_csv(data_path, nrows=100))
+        else:
+            df_sample = load_predictions().head(100).reset_index()
         # 将NaN值转换为null，以便JSON正确解析
         df_sample = df_sample.fillna(value=np.nan)
         # 转换为字典并处理NaN值